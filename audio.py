@@ -0,0 +1,89 @@
+import functools
+import math
+import operator
+import wave
+from array import array
+
+import const
+
+# Offline rendering of a record with a simple music box voice: each tine is a
+# few decaying sine partials with a short attack. The voice of each note is
+# computed once, a record is then mixed by adding whole voices at the sample
+# offset of their beat, with list slices so the additions run in C.
+
+SAMPLE_RATE = 44100
+NOTE_SEC = 1.5
+# (frequency ratio, amplitude, decay per second) of the partials of a tine
+PARTIALS = [(1, 1.0, 3.0), (2, 0.25, 6.0), (5.4, 0.08, 14.0)]
+ATTACK_SEC = 0.003
+PEAK = 32767 * 0.9
+
+
+def note_frequency(note):
+    return 440.0 * 2 ** ((note - 69) / 12)
+
+
+@functools.lru_cache(maxsize=None)
+def voice(note, sample_rate=SAMPLE_RATE):
+    """Samples of one plucked tine, as a tuple of floats"""
+    frequency = note_frequency(note)
+    attack = ATTACK_SEC * sample_rate
+    samples = []
+    for i in range(int(NOTE_SEC * sample_rate)):
+        t = i / sample_rate
+        value = 0.0
+        for ratio, amplitude, decay in PARTIALS:
+            value += amplitude * math.exp(-decay * t) * math.sin(
+                2 * math.pi * frequency * ratio * t
+            )
+        if i < attack:
+            value *= i / attack
+        samples.append(value)
+    return tuple(samples)
+
+
+def beat_period(record, wholedisc=False, tempo=1.0):
+    if wholedisc:
+        # a record without beats is spread as a full disc would be
+        return const.WHOLEDISC_SEC / (record.beats_count or const.BEAT_COUNT) / tempo
+    return const.BEAT_SEC / tempo
+
+
+def render(record, period, sample_rate=SAMPLE_RATE):
+    """Mix the record into a list of float samples"""
+    beat_samples = period * sample_rate
+    length = int(record.beats_count * beat_samples) + int(NOTE_SEC * sample_rate)
+    mix = [0.0] * length
+    for beat_index, notes in enumerate(record.get_events()):
+        start = int(beat_index * beat_samples)
+        for note in notes:
+            samples = voice(note, sample_rate)
+            end = start + len(samples)
+            mix[start:end] = map(operator.add, mix[start:end], samples)
+    return mix
+
+
+def to_pcm(mix):
+    """16 bits signed samples, scaled so that the loudest one is at PEAK"""
+    peak = max(map(abs, mix), default=0)
+    if not peak:
+        return array("h", bytes(2 * len(mix)))
+    scale = PEAK / peak
+    return array("h", [round(sample * scale) for sample in mix])
+
+
+def write_wav(filename, pcm, sample_rate=SAMPLE_RATE):
+    with wave.open(filename, "wb") as fp:
+        fp.setnchannels(1)
+        fp.setsampwidth(2)
+        fp.setframerate(sample_rate)
+        fp.writeframes(pcm.tobytes())
+
+
+def write_raw(filename, pcm):
+    """Headerless 16 bits little endian mono samples"""
+    if array("h", [1]).tobytes() != b"\x01\x00":
+        pcm = array("h", pcm)
+        pcm.byteswap()
+    with open(filename, "wb") as fp:
+        pcm.tofile(fp)
@@ -0,0 +1,82 @@
+import math
+import operator
+from collections import namedtuple
+
+import const
+import midi
+
+# Search of the transposition, tempo and rounding of the beats that fit the
+# notes of a midi file best on the record player. Every combination is tried:
+# what depends on the transposition alone (notes played exactly or replaced
+# by the nearest one) is counted once per transposition from a histogram of
+# the notes, the beats are rounded once per tempo and phase, and only the
+# collisions (notes landing on a cell that already has one) are counted for
+# each candidate, with map() and set() over the whole list of notes.
+# Transpositions are tried best first, those that cannot score as well as the
+# best candidate so far even without collisions are skipped.
+
+# semitones added to the midi notes
+TRANSPOSITIONS = range(-24, 25)
+# factors of the beat positions, from half to twice the tempo
+TEMPOS = [2 ** (step / 6) for step in range(-6, 7)]
+# the beat of a note is ceil(position * tempo - phase)
+PHASES = [step / 8 for step in range(8)]
+
+# points of a candidate for each note
+EXACT_POINTS = 1
+SUBSTITUTED_POINTS = -1
+COLLISION_POINTS = -1
+OVERFLOW_POINTS = -0.5  # note after the 86 beats of a disc
+
+Fit = namedtuple("Fit", ["offset", "tempo", "phase"])
+
+
+def search(positions, notes, record_notes, default_offset=0):
+    """Best Fit for the notes at the given positions (in beats), the one
+    closest to the default offset, the original tempo and no phase on a tie"""
+    if not notes:
+        return Fit(default_offset, 1.0, 0.0)
+
+    histogram = [0] * 128
+    for note in notes:
+        histogram[note] += 1
+    exact_table = midi.note_table(record_notes)
+    tables = {}
+    pitch_points = {}
+    for offset in TRANSPOSITIONS:
+        exact = sum(
+            count for note, count in enumerate(histogram)
+            if count and 0 <= note + offset < 128 and exact_table[note + offset] >= 0
+        )
+        pitch_points[offset] = (
+            exact * EXACT_POINTS + (len(notes) - exact) * SUBSTITUTED_POINTS
+        )
+        # the track of each note once transposed, as a cell number offset
+        nearest = midi.nearest_note_table(record_notes, offset)
+        tables[offset] = list(map(nearest.__getitem__, notes))
+
+    offsets = sorted(TRANSPOSITIONS, key=pitch_points.get, reverse=True)
+    best = None
+    for tempo in TEMPOS:
+        for phase in PHASES:
+            beats = [math.ceil(position * tempo - phase) for position in positions]
+            overflow = sum(beat >= const.BEAT_COUNT for beat in beats)
+            # a cell number per note: its beat times 32 plus its track
+            beat_cells = [beat << 5 for beat in beats]
+            for offset in offsets:
+                # collisions only lower the score: stop at the transpositions
+                # that cannot reach the best one
+                score = pitch_points[offset] + overflow * OVERFLOW_POINTS
+                if best is not None and score < best[0][0]:
+                    break
+                cells = len(set(map(operator.add, beat_cells, tables[offset])))
+                score += (len(notes) - cells) * COLLISION_POINTS
+                key = (
+                    score,
+                    -abs(offset - default_offset),
+                    -abs(math.log(tempo)),
+                    -phase,
+                )
+                if best is None or key > best[0]:
+                    best = (key, Fit(offset, tempo, phase))
+    return best[1]
@@ -0,0 +1,59 @@
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Helpers of the command line tools converting many files with a pool of
+# worker processes: a bad file is reported and the others are still converted.
+
+
+def find_files(paths, pattern="*.fpr"):
+    """Files matching pattern in directories, and files of glob patterns"""
+    filenames = []
+    for path in paths:
+        if os.path.isdir(path):
+            filenames.extend(sorted(glob.glob(os.path.join(path, pattern))))
+        else:
+            filenames.extend(sorted(glob.glob(path)) or [path])
+    return filenames
+
+
+def output_name(filename, outdir, extension):
+    """filename with another extension, in outdir when given"""
+    basename = os.path.splitext(filename)[0]
+    if outdir:
+        basename = os.path.join(outdir, os.path.basename(basename))
+    return basename + extension
+
+
+def timed_call(function_and_job):
+    """Run function(**job), never raises: returns (job, seconds, error)"""
+    function, job = function_and_job
+    start = time.perf_counter()
+    error = None
+    try:
+        function(**job)
+    except Exception as e:
+        error = "{}: {}".format(type(e).__name__, e)
+    return job, time.perf_counter() - start, error
+
+
+def run_jobs(function, jobs, workers=None, describe=str):
+    """Call function(**job) for each job in worker processes (default: one per
+    CPU), print the time of each one and return the number of failures"""
+    failed = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        calls = [(function, job) for job in jobs]
+        for job, seconds, error in executor.map(timed_call, calls):
+            if error is None:
+                print("{:8.3f}s {}".format(seconds, describe(job)))
+            else:
+                failed += 1
+                print("{:8.3f}s {} FAILED {}".format(seconds, describe(job), error))
+    print(
+        "{} converted, {} failed in {:.3f}s".format(
+            len(jobs) - failed, failed, time.perf_counter() - start
+        )
+    )
+    return failed
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+import os
+import sys
+import argparse
+import contextlib
+import curses
+import json
+import platform
+import random
+import tempfile
+import timeit
+
+import const
+import maniacs_mid_to_fpr
+import midi
+import scad
+from input import Input
+from record import Record
+
+# Benchmarks of the hot paths on synthetic records. A benchmark is timed with
+# timeit: as many calls as take 0.2 s, repeated, the best run gives the
+# time of a call. Results can be saved as a json baseline, a later run
+# compared to it flags the benchmarks that got slower.
+
+REPEAT = 5
+# ratio to the baseline time above which a benchmark is a regression
+THRESHOLD = 1.25
+
+# beats count and probability of a note in each cell
+SHAPES = {
+    "sparse": (const.BEAT_COUNT, 0.05),
+    "dense": (const.BEAT_COUNT, 0.5),
+    "long": (5000, 0.2),
+}
+
+
+def generate(beats_count, density, seed=0):
+    """Record with a note in each cell with the probability density"""
+    rng = random.Random(seed)
+    record = Record(beats_count, const.TRACK_COUNT)
+    for beat_index in range(beats_count):
+        mask = 0
+        for track_index in range(const.TRACK_COUNT):
+            if rng.random() < density:
+                mask |= 1 << track_index
+        record.set_mask(beat_index, mask)
+    record.title = "Synthetic {} beats at {:g}".format(beats_count, density)
+    return record
+
+
+def generate_records():
+    """The records of SHAPES by name, and "two_sided", a (record, record_bis)
+    pair for a disc"""
+    records = {
+        name: generate(beats_count, density)
+        for name, (beats_count, density) in SHAPES.items()
+    }
+    records["two_sided"] = (
+        generate(const.BEAT_COUNT, 0.2, seed=1),
+        generate(const.BEAT_COUNT, 0.2, seed=2),
+    )
+    return records
+
+
+class FakeWindow:
+    """Curses window drawing nowhere, for Input"""
+
+    def move(self, y, x):
+        pass
+
+    def addch(self, *args):
+        pass
+
+    def addstr(self, *args):
+        pass
+
+    def vline(self, *args):
+        pass
+
+
+@contextlib.contextmanager
+def fake_color_pairs():
+    # curses.color_pair needs initscr(), do what it does on the attributes
+    color_pair = curses.color_pair
+    curses.color_pair = lambda pair: pair << 8
+    try:
+        yield
+    finally:
+        curses.color_pair = color_pair
+
+
+def record_cases(records, workdir):
+    for name in SHAPES:
+        record = records[name]
+        record.filename = os.path.join(workdir, name + ".fpr")
+        record.save()
+
+        def load(filename=record.filename):
+            loaded = Record(0, const.TRACK_COUNT)
+            loaded.filename = filename
+            loaded.load()
+
+        yield "record.load/" + name, load
+        yield "record.to_fpr/" + name, record.to_fpr
+        yield "record.save/" + name, record.save
+
+    # a shift and its opposite, the record is the same after each call
+    record = records["long"]
+
+    def left_shift(record=record):
+        record.undo_left_shift(0, record.left_shift(0))
+
+    def right_shift(record=record):
+        record.right_shift(0)
+        record.undo_right_shift(0)
+
+    yield "record.left_shift/long", left_shift
+    yield "record.right_shift/long", right_shift
+
+
+def scad_cases(records, workdir):
+    for name in ("sparse", "dense", "two_sided"):
+        sides = records[name] if name == "two_sided" else (records[name], None)
+
+        def to_scad(sides=sides):
+            scad.to_scad("bench", "", 5 if sides[1] else 3, *sides)
+
+        yield "scad.to_scad/" + name, to_scad
+    for name in ("dense", "long"):
+        record = records[name]
+        expanded_record = scad.ExpandedRecord(
+            record.beats_count, len(scad.TRACK_RADIUS), record
+        )
+        yield "scad.get_pins/" + name, lambda expanded_record=expanded_record: (
+            scad.get_pins(expanded_record, False)
+        )
+
+
+def midi_cases(records, workdir):
+    record = records["long"]
+    mid_file = os.path.join(workdir, "long.mid")
+    midi.write_file(mid_file, [midi.record_track(record)])
+
+    def read(mid_file=mid_file):
+        with open(mid_file, "rb") as fp:
+            ticks_per_beat, events = midi.read_events(fp)
+            for _ in midi.note_ons(events):
+                pass
+
+    yield "midi.record_track/long", lambda: midi.record_track(record)
+    yield "midi.read/long", read
+
+    try:
+        import music_box_tracker
+    except ImportError as e:
+        reason = "music_box_tracker cannot be imported: {}".format(e)
+        yield "tracker.export_to_mid/long", reason
+        yield "tracker.import_from_mid/long", reason
+        return
+    # export_to_mid writes to title + ".mid"
+    exported = generate(*SHAPES["long"])
+    exported.title = os.path.join(workdir, "exported")
+    yield "tracker.export_to_mid/long", lambda: music_box_tracker.export_to_mid(exported, 0)
+    yield "tracker.import_from_mid/long", lambda: music_box_tracker.import_from_mid(
+        Record(0, const.TRACK_COUNT), mid_file
+    )
+
+
+def maniacs_cases(records, workdir):
+    for name, fit in (("long", False), ("dense", True)):
+        mid_file = os.path.join(workdir, "maniacs_" + name + ".mid")
+        midi.write_file(mid_file, [midi.record_track(records[name])])
+        fpr_file = os.path.join(workdir, "maniacs_" + name + ".fpr")
+
+        def convert(mid_file=mid_file, fpr_file=fpr_file, fit=fit):
+            maniacs_mid_to_fpr.convert(mid_file, fpr_file, fit=fit)
+
+        yield "maniacs.convert{}/{}".format("_autofit" if fit else "", name), convert
+
+
+def input_cases(records, workdir):
+    record = records["dense"]
+    input = Input(record, FakeWindow())
+
+    def full(input=input):
+        input.invalidate()
+        input.draw_partition()
+
+    def one_note(input=input):
+        record.reverse_note(input.beats_count // 2, const.TRACK_COUNT // 2)
+        input.draw_partition()
+
+    yield "input.draw_partition/dense", full
+    yield "input.draw_partition_one_note/dense", one_note
+
+
+CASES = [record_cases, scad_cases, midi_cases, maniacs_cases, input_cases]
+
+
+def measure(function, repeat=REPEAT):
+    """Best time of a call in seconds"""
+    timer = timeit.Timer(function)
+    number, elapsed = timer.autorange()
+    times = [elapsed] + timer.repeat(repeat - 1, number)
+    return min(times) / number
+
+
+def run(names=None, repeat=REPEAT, log=lambda msg: None):
+    """{name: seconds per call or the reason it was skipped} of the benchmarks
+    whose name contains one of names, all of them without names"""
+    results = {}
+    records = generate_records()
+    with tempfile.TemporaryDirectory() as workdir, fake_color_pairs():
+        for cases in CASES:
+            for name, function in cases(records, workdir):
+                if names and not any(part in name for part in names):
+                    continue
+                if isinstance(function, str):
+                    results[name] = function
+                else:
+                    results[name] = measure(function, repeat)
+                log(format_result(name, results[name]))
+    return results
+
+
+def format_time(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return "{:.3g} {}".format(seconds / scale, unit)
+    return "{:.3g} ns".format(seconds / 1e-9)
+
+
+def format_result(name, result):
+    if isinstance(result, str):
+        return "{:40} skipped ({})".format(name, result)
+    return "{:40} {:>10}".format(name, format_time(result))
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """Lines comparing results to the baseline ones, and the names of the
+    benchmarks slower than threshold times their baseline"""
+    lines = []
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if isinstance(result, str) or not isinstance(base, (int, float)):
+            lines.append(format_result(name, result) + "  (no baseline)")
+            continue
+        ratio = result / base
+        line = "{:40} {:>10} {:>10} {:6.2f}x".format(
+            name, format_time(result), format_time(base), ratio
+        )
+        if ratio > threshold:
+            regressions.append(name)
+            line += "  REGRESSION"
+        lines.append(line)
+    return lines, regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="time the hot paths on synthetic records, save the times as a "
+        "json baseline or compare them to one"
+    )
+    parser.add_argument(
+        "names",
+        nargs="*",
+        help="run only the benchmarks whose name contains one of these (e.g. scad record.load)",
+    )
+    parser.add_argument("--save", help="json file to write the results to")
+    parser.add_argument(
+        "--compare",
+        help="json baseline to compare the results to, exits with 1 on a regression",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=THRESHOLD,
+        help="ratio to the baseline time flagged as a regression (default:{:g})".format(
+            THRESHOLD
+        ),
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=REPEAT, help="runs of each benchmark (default:{})".format(REPEAT)
+    )
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)["results"]
+
+    results = run(args.names, args.repeat, log=print if baseline is None else lambda msg: None)
+    if args.save:
+        with open(args.save, "w") as fp:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "results": results,
+                },
+                fp,
+                indent=2,
+            )
+    if baseline is not None:
+        lines, regressions = compare(results, baseline, args.threshold)
+        print("\n".join(lines))
+        if regressions:
+            print("{} regression(s): {}".format(len(regressions), ", ".join(regressions)))
+            sys.exit(1)
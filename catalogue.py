@@ -0,0 +1,145 @@
+import hashlib
+import io
+import json
+import os
+import sqlite3
+
+import const
+
+# Index of the .fpr files of directories in a sqlite database: title, comment,
+# beat count, notes per track and sha1 of each file. A scan only reads the
+# files whose size or mtime changed since the previous one.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tunes (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    comment TEXT NOT NULL,
+    beats_count INTEGER NOT NULL,
+    notes_count INTEGER NOT NULL,
+    histogram TEXT NOT NULL,
+    sha1 TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tunes_title ON tunes (title);
+CREATE INDEX IF NOT EXISTS tunes_sha1 ON tunes (sha1);
+"""
+NOTE_FPR = "+"
+
+
+def default_database():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "music-box-tune-tracker", "catalogue.sqlite")
+
+
+def connect(database=None):
+    database = database or default_database()
+    os.makedirs(os.path.dirname(os.path.abspath(database)), exist_ok=True)
+    connection = sqlite3.connect(database)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def iter_fpr_files(directory, errors):
+    """(path, stat) of the .fpr files under a directory, the directories and
+    files that cannot be read are appended to errors as (path, OSError)"""
+    stack = [directory]
+    while stack:
+        path = stack.pop()
+        try:
+            with os.scandir(path) as iterator:
+                entries = list(iterator)
+        except OSError as e:
+            errors.append((path, e))
+            continue
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(".fpr") and entry.is_file():
+                    yield entry.path, entry.stat()
+            except OSError as e:
+                errors.append((entry.path, e))
+
+
+def index_row(path, stat):
+    # the rows of a .fpr are its tracks, counting their notes is enough, the
+    # partition does not have to be built
+    with open(path, "rb") as fp:
+        data = fp.read()
+    text = io.StringIO(data.decode("utf-8", "replace"))
+    rows = [text.readline().rstrip() for _ in range(const.TRACK_COUNT)]
+    counts = [row.count(NOTE_FPR) for row in rows]
+    title = text.readline().rstrip()
+    return (
+        path,
+        stat.st_mtime_ns,
+        stat.st_size,
+        title,
+        text.read(),
+        max(map(len, rows)),
+        sum(counts),
+        json.dumps(counts),
+        hashlib.sha1(data).hexdigest(),
+    )
+
+
+def scan(connection, directories, log=lambda msg: None):
+    """Bring the index of the directories up to date, returns the number of
+    (unchanged, updated, removed, skipped) files. The files and directories
+    that cannot be read are skipped and reported to log, what was indexed
+    of them is kept."""
+    unchanged = updated = removed = skipped = 0
+    for directory in directories:
+        root = os.path.abspath(directory)
+        prefix = os.path.join(root, "")
+        known = {
+            path: (mtime_ns, size)
+            for path, mtime_ns, size in connection.execute(
+                "SELECT path, mtime_ns, size FROM tunes WHERE substr(path, 1, ?) = ?",
+                (len(prefix), prefix),
+            )
+        }
+        rows = []
+        errors = []
+        for path, stat in iter_fpr_files(root, errors):
+            if known.pop(path, None) == (stat.st_mtime_ns, stat.st_size):
+                unchanged += 1
+            else:
+                try:
+                    rows.append(index_row(path, stat))
+                except OSError as e:
+                    errors.append((path, e))
+        for path, error in errors:
+            log("skipped {}: {}".format(path, error.strerror or error))
+            # not seen, but not removed either
+            inside = os.path.join(path, "")
+            for known_path in [p for p in known if p == path or p.startswith(inside)]:
+                del known[known_path]
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO tunes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+            )
+            connection.executemany(
+                "DELETE FROM tunes WHERE path = ?", [(path,) for path in known]
+            )
+        updated += len(rows)
+        removed += len(known)
+        skipped += len(errors)
+    return unchanged, updated, removed, skipped
+
+
+def search(connection, text=""):
+    """(path, title, beats count, notes count) of the tunes whose title,
+    comment or path contains the text, by title"""
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    pattern = "%" + escaped + "%"
+    return connection.execute(
+        "SELECT path, title, beats_count, notes_count FROM tunes "
+        "WHERE title LIKE ? ESCAPE '\\' OR comment LIKE ? ESCAPE '\\' "
+        "OR path LIKE ? ESCAPE '\\' ORDER BY title, path",
+        (pattern, pattern, pattern),
+    ).fetchall()
@@ -7,3 +7,7 @@ PAIR_HIGHLIGHT = 4
 # Fisher Price Records
 BEAT_COUNT = 86
 TRACK_COUNT = 16
+
+# playback: seconds per beat, or per revolution when a record covers the whole disc
+BEAT_SEC = 0.5
+WHOLEDISC_SEC = 25.0
@@ -0,0 +1,201 @@
+import collections
+import io
+
+import catalogue
+import const
+from record import Record
+
+# Fingerprints of tunes to find the copies of a tune in a catalogue, even when
+# transposed, shifted in time or slightly edited.
+# The non empty beats of a record are turned into a sequence of symbols and
+# every window of SHINGLE consecutive symbols is hashed with a rolling hash.
+# Winnowing keeps the smallest hash of every WINNOW consecutive ones, so two
+# tunes sharing a long enough passage share fingerprints whatever its
+# position. Each tune gets two sets of fingerprints: of its masks as they are,
+# and of the masks relative to their lowest note, which do not change when
+# the tune is transposed.
+
+SHINGLE = 6
+WINNOW = 4
+BASE = 1000003
+MODULUS = (1 << 61) - 1
+# hashes shared by more tunes are too common to tell anything (e.g. a scale)
+MAX_POSTINGS = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fingerprints (
+    sha1 TEXT NOT NULL,
+    hash INTEGER NOT NULL,
+    invariant INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fingerprints_sha1 ON fingerprints (sha1);
+CREATE INDEX IF NOT EXISTS fingerprints_hash ON fingerprints (invariant, hash);
+"""
+
+
+def symbols(record, invariant=False):
+    """One symbol per non empty beat: its mask, or with invariant the mask
+    shifted down to its lowest note and the move of that note since the
+    previous beat"""
+    result = []
+    previous_low = None
+    for mask in record.get_masks()[: record.beats_count]:
+        if not mask:
+            continue
+        if not invariant:
+            result.append(mask)
+            continue
+        low = (mask & -mask).bit_length() - 1
+        move = 0 if previous_low is None else low - previous_low
+        previous_low = low
+        result.append((mask >> low) << 8 | move & 0xFF)
+    return result
+
+
+def rolling_hashes(sequence, length=SHINGLE):
+    """Rabin-Karp hashes of the windows of the given length, a single hash of
+    the whole sequence when it is shorter"""
+    length = min(length, len(sequence))
+    if not length:
+        return []
+    drop = pow(BASE, length - 1, MODULUS)
+    value = 0
+    for symbol in sequence[:length]:
+        value = (value * BASE + symbol + 1) % MODULUS
+    hashes = [value]
+    for index in range(length, len(sequence)):
+        value = (value - (sequence[index - length] + 1) * drop) % MODULUS
+        value = (value * BASE + sequence[index] + 1) % MODULUS
+        hashes.append(value)
+    return hashes
+
+
+def winnow(hashes, window=WINNOW):
+    """Smallest hash of each window of consecutive hashes"""
+    if len(hashes) <= window:
+        return {min(hashes)} if hashes else set()
+    return {min(hashes[index : index + window]) for index in range(len(hashes) - window + 1)}
+
+
+def fingerprints(record, invariant=False):
+    return winnow(rolling_hashes(symbols(record, invariant)))
+
+
+def connect(database=None):
+    connection = catalogue.connect(database)
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def update(connection):
+    """Fingerprint the tunes of the catalogue that are not yet, tunes with the
+    same content share their fingerprints. Returns the number of new ones."""
+    rows = connection.execute(
+        "SELECT sha1, MIN(path) FROM tunes WHERE sha1 NOT IN "
+        "(SELECT DISTINCT sha1 FROM fingerprints) GROUP BY sha1"
+    ).fetchall()
+    values = []
+    for sha1, path in rows:
+        record = Record(0, const.TRACK_COUNT)
+        try:
+            with open(path, "rb") as fp:
+                record.read(io.StringIO(fp.read().decode("utf-8", "replace")))
+        except FileNotFoundError:
+            continue  # removed since the last scan
+        for invariant in (0, 1):
+            values.extend((sha1, value, invariant) for value in fingerprints(record, invariant))
+    with connection:
+        connection.executemany("INSERT INTO fingerprints VALUES (?, ?, ?)", values)
+        connection.execute(
+            "DELETE FROM fingerprints WHERE sha1 NOT IN (SELECT sha1 FROM tunes)"
+        )
+    return len(rows)
+
+
+def load(connection, invariant):
+    """Fingerprints of each content, and the contents of each fingerprint"""
+    by_sha1 = collections.defaultdict(set)
+    postings = collections.defaultdict(list)
+    for sha1, value in connection.execute(
+        "SELECT sha1, hash FROM fingerprints WHERE invariant = ?", (int(invariant),)
+    ):
+        by_sha1[sha1].add(value)
+        postings[value].append(sha1)
+    return by_sha1, postings
+
+
+def similar_pairs(by_sha1, postings, threshold):
+    """{(sha1, sha1): share} of the contents sharing at least threshold of the
+    fingerprints of the smaller one, found through the postings, without
+    comparing every pair"""
+    shared = collections.Counter()
+    for sha1s in postings.values():
+        if 1 < len(sha1s) <= MAX_POSTINGS:
+            sha1s.sort()
+            for index, sha1 in enumerate(sha1s):
+                for other in sha1s[index + 1 :]:
+                    shared[sha1, other] += 1
+    pairs = {}
+    for (sha1, other), count in shared.items():
+        share = count / min(len(by_sha1[sha1]), len(by_sha1[other]))
+        if share >= threshold:
+            pairs[sha1, other] = share
+    return pairs
+
+
+def clusters(connection, threshold=0.5):
+    """Groups of paths of the tunes that are copies of each other, each as a
+    list of (path, title, how) where how tells how the tune compares to the
+    first one of the group: "" for the first one itself, "identical" (same
+    file content), "copy" (same notes), "transposed" or "similar" """
+    exact = similar_pairs(*load(connection, False), threshold)
+    invariant = similar_pairs(*load(connection, True), threshold)
+
+    # union find of the contents linked by a transposition invariant pair
+    parent = {}
+
+    def find(sha1):
+        parent.setdefault(sha1, sha1)
+        while parent[sha1] != sha1:
+            parent[sha1] = parent[parent[sha1]]
+            sha1 = parent[sha1]
+        return sha1
+
+    for sha1, other in invariant:
+        parent[find(other)] = find(sha1)
+
+    groups = collections.defaultdict(list)
+    for sha1 in parent:
+        groups[find(sha1)].append(sha1)
+    tunes = collections.defaultdict(list)
+    for path, title, sha1 in connection.execute("SELECT path, title, sha1 FROM tunes"):
+        tunes[sha1].append((path, title))
+
+    result = []
+    for sha1s in groups.values():
+        sha1s.sort()
+        first = sha1s[0]
+        group = []
+        for sha1 in sha1s:
+            if sha1 == first:
+                how = "identical"
+            else:
+                pair = tuple(sorted((first, sha1)))
+                share = exact.get(pair, 0)
+                if share >= 1:
+                    how = "copy"
+                elif share:
+                    how = "similar"
+                else:
+                    how = "transposed" if invariant.get(pair, 0) >= 1 else "similar"
+            group.extend((path, title, how) for path, title in sorted(tunes[sha1]))
+        result.append(group)
+    result.extend(
+        [(path, title, "identical") for path, title in sorted(paths)]
+        for sha1, paths in tunes.items()
+        if len(paths) > 1 and sha1 not in parent
+    )
+    for group in result:
+        path, title, _ = group[0]
+        group[0] = (path, title, "")
+    return result
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+import sys
+import argparse
+import time
+import catalogue
+
+
+def print_tunes(tunes):
+    for number, (path, title, beats_count, notes_count) in enumerate(tunes, 1):
+        print("{:5d} {:32} {:5d} beats {:5d} notes  {}".format(
+            number, title, beats_count, notes_count, path))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="index .fpr files and search them")
+    parser.add_argument("text", nargs="?", default="", help="text to search in titles, comments and paths")
+    parser.add_argument("--scan", nargs="+", help="directories of .fpr files to index")
+    parser.add_argument(
+        "--db", help="index database (default: {})".format(catalogue.default_database())
+    )
+    args = parser.parse_args()
+
+    connection = catalogue.connect(args.db)
+    if args.scan:
+        start = time.perf_counter()
+        unchanged, updated, removed, skipped = catalogue.scan(connection, args.scan, print)
+        print("{} unchanged, {} updated, {} removed, {} skipped in {:.3f}s".format(
+            unchanged, updated, removed, skipped, time.perf_counter() - start))
+        if not args.text:
+            sys.exit(1 if skipped else 0)
+    print_tunes(catalogue.search(connection, args.text))
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+import argparse
+import time
+import catalogue
+import fingerprint
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="report the tunes of the catalogue that are copies of each other"
+    )
+    parser.add_argument("--scan", nargs="+", help="directories of .fpr files to index first")
+    parser.add_argument(
+        "--db", help="index database (default: {})".format(catalogue.default_database())
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.5,
+        help="share of the fingerprints of the shorter tune two tunes must have "
+        "in common (default: 0.5)",
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    connection = fingerprint.connect(args.db)
+    if args.scan:
+        catalogue.scan(connection, args.scan, print)
+    fingerprinted = fingerprint.update(connection)
+    groups = fingerprint.clusters(connection, args.threshold)
+    for group in sorted(groups):
+        print()
+        for path, title, how in group:
+            print("{:10} {:32} {}".format(how, title, path))
+    print(
+        "\n{} groups, {} tunes fingerprinted in {:.3f}s".format(
+            len(groups), fingerprinted, time.perf_counter() - start
+        )
+    )
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+import os
+import sys
+import argparse
+import batch
+import const
+import library
+
+from record import Record
+
+# Conversion between .fpr files and record libraries.
+
+
+def pack(library_file, paths):
+    records = []
+    for fpr_file in batch.find_files(paths):
+        if not os.path.isfile(fpr_file):
+            raise FileNotFoundError("Cannot find " + fpr_file)
+        record = Record(0, const.TRACK_COUNT)
+        record.filename = fpr_file
+        record.load()
+        records.append(record)
+    library.write_library(library_file, records)
+    print("{} records packed in {}".format(len(records), library_file))
+
+
+def unpack(library_file, outdir, names=None):
+    """Write records of a library back to .fpr files, all of them or those of
+    the given names"""
+    os.makedirs(outdir, exist_ok=True)
+    with library.Library(library_file) as records:
+        if names:
+            indexes = []
+            for name in names:
+                index = records.find(name)
+                if index < 0:
+                    raise KeyError("No record named " + name)
+                indexes.append(index)
+        else:
+            indexes = range(len(records))
+        for index in indexes:
+            record = records.record(index)
+            record.filename = os.path.join(outdir, record.filename)
+            record.save()
+    print("{} records written to {}".format(len(indexes), outdir))
+
+
+def list_records(library_file):
+    with library.Library(library_file) as records:
+        for index in range(len(records)):
+            print(
+                "{:6d} {:5d} {:24} {}".format(
+                    index, records.beats_count(index), records.name(index), records.title(index)
+                )
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="pack fpr files in a record library, list it or unpack it"
+    )
+    parser.add_argument("library", help="library file")
+    parser.add_argument(
+        "--pack",
+        nargs="+",
+        help="create the library from fpr files, directories or glob patterns of fpr files",
+    )
+    parser.add_argument("--unpack", help="directory to write the fpr files of the library to")
+    parser.add_argument(
+        "--name", nargs="+", help="names of the records to unpack (default: all)"
+    )
+    args = parser.parse_args()
+
+    try:
+        if args.pack:
+            pack(args.library, args.pack)
+        elif args.unpack:
+            unpack(args.library, args.unpack, args.name)
+        else:
+            list_records(args.library)
+    except (FileNotFoundError, KeyError, ValueError) as e:
+        print(e)
+        sys.exit(1)
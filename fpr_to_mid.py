@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+import os
+import sys
+import argparse
+import time
+import batch
+import const
+import midi
+
+from record import Record
+
+# Export of many records to midi, either one file per record or a single
+# "jukebox" file with one track per record, named after its title.
+
+
+def load_record(fpr_file):
+    if not os.path.isfile(fpr_file):
+        raise FileNotFoundError("Cannot find " + fpr_file)
+    record = Record(0, const.TRACK_COUNT)
+    record.filename = fpr_file
+    record.load()
+    return record
+
+
+def export_file(fpr_file, mid_file=None, program=None):
+    mid_file = mid_file or os.path.splitext(fpr_file)[0] + ".mid"
+    record = load_record(fpr_file)
+    midi.write_file(mid_file, [midi.record_track(record, program, record.title)])
+    return mid_file
+
+
+def export_jukebox(fpr_files, mid_file, program=None):
+    """One type 1 file with a track per record, records that cannot be read
+    are reported and left out. Returns the number of failures."""
+    failed = 0
+    with open(mid_file, "wb") as fp:
+        midi.write_header(fp, len(fpr_files))
+        tracks_count = 0
+        for fpr_file in fpr_files:
+            start = time.perf_counter()
+            try:
+                record = load_record(fpr_file)
+                fp.write(midi.record_track(record, program, record.title))
+            except Exception as e:
+                failed += 1
+                print("{:8.3f}s {} FAILED {}: {}".format(
+                    time.perf_counter() - start, fpr_file, type(e).__name__, e))
+                continue
+            tracks_count += 1
+            print("{:8.3f}s {}".format(time.perf_counter() - start, fpr_file))
+        if tracks_count != len(fpr_files):
+            fp.seek(0)
+            midi.write_header(fp, tracks_count)
+    print("{} tracks written to {}, {} failed".format(tracks_count, mid_file, failed))
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="export fpr files to midi files")
+    parser.add_argument(
+        "fpr", nargs="+", help="fpr files, directories or glob patterns of fpr files"
+    )
+    parser.add_argument(
+        "--jukebox",
+        help="write a single midi file with one track per record instead of one file per record",
+    )
+    parser.add_argument("--outdir", help="directory of the midi files, one per record")
+    parser.add_argument("--program", help="midi instrument code")
+    parser.add_argument(
+        "--jobs", help="number of worker processes, one file per record (default: CPU count)"
+    )
+
+    args = parser.parse_args()
+    program = int(args.program) if args.program else None
+    fpr_files = batch.find_files(args.fpr)
+
+    if args.jukebox:
+        sys.exit(1 if export_jukebox(fpr_files, args.jukebox, program) else 0)
+
+    jobs = [
+        {
+            "fpr_file": fpr_file,
+            "mid_file": batch.output_name(fpr_file, args.outdir, ".mid"),
+            "program": program,
+        }
+        for fpr_file in fpr_files
+    ]
+    if args.outdir:
+        os.makedirs(args.outdir, exist_ok=True)
+    workers = int(args.jobs) if args.jobs else None
+    describe = lambda job: job["fpr_file"]
+    sys.exit(1 if batch.run_jobs(export_file, jobs, workers, describe) else 0)
@@ -2,68 +2,241 @@
 import os
 import sys
 import argparse
-import time, datetime
+import csv
+import json
+import datetime
 from pathlib import Path
+import batch
 import scad
+import stl
+import validate
 import const
 
 from record import Record
 
-parser = argparse.ArgumentParser()
-parser.add_argument("--fpr", help="name of fpr file", required=True)
-parser.add_argument("--fprbis", help="name of fpr file for second side")
-parser.add_argument("--scad", help="name of scad file to output")
-parser.add_argument(
-    "--thickness", help="thickness in mm. Defaults to 3 if one side or 5 if two sides"
-)
-parser.add_argument("--beats",help="number of beats to translate (default:86) 0 => all beats")
-parser.add_argument("--beatsbis",help="number of beats to translate for second side (default:86) 0 => all beats")
-
-args = parser.parse_args()
-
-fpr_file = args.fpr
-fpr_file_bis = args.fprbis
-scad_file = args.scad or os.path.splitext(fpr_file)[0] + ".scad"
-thickness = None
-if args.thickness:
-    thickness = float(args.thickness)
-else:
-    thickness = 5 if fpr_file_bis else 3
-beat_cut = const.BEAT_COUNT
-if args.beats:
-    beat_cut = int(args.beats)
-beat_cut_bis = const.BEAT_COUNT
-if args.beatsbis:
-    beat_cut_bis = int(args.beatsbis)
-
-if not Path(fpr_file).is_file():
-    print("Cannot find " + fpr_file)
-    sys.exit()
-
-record = Record(0, const.TRACK_COUNT)
-record.filename = fpr_file
-record.load()
-if beat_cut>0:
-    record.resize_beats(beat_cut)
-
-record_bis = None
-if fpr_file_bis is not None:
-    if not Path(fpr_file_bis).is_file():
-        print("Cannot find " + fpr_file_bis)
-        sys.exit()
+VERSION = "1.0"
 
-    record_bis = Record(0, const.TRACK_COUNT)
-    record_bis.filename = fpr_file_bis
-    record_bis.load()
-    if beat_cut_bis>0:
-        record_bis.resize_beats(beat_cut_bis)
 
+def load_record(fpr_file, beat_cut):
+    record = Record(0, const.TRACK_COUNT)
+    record.filename = fpr_file
+    record.load()
+    if beat_cut > 0:
+        record.resize_beats(beat_cut)
+    return record
+
+
+def convert(fpr_file, fpr_file_bis=None, scad_file=None, thickness=None,
+            beat_cut=const.BEAT_COUNT, beat_cut_bis=const.BEAT_COUNT,
+            compact=False, precision=None, to_stl=False,
+            title_font=None, check=False):
+    extension = ".stl" if to_stl else ".scad"
+    scad_file = scad_file or os.path.splitext(fpr_file)[0] + extension
+    if thickness is None:
+        thickness = 5 if fpr_file_bis else 3
+
+    for filename in (fpr_file, fpr_file_bis):
+        if filename is not None and not Path(filename).is_file():
+            raise FileNotFoundError("Cannot find " + filename)
+
+    # the whole records are loaded first so that the check sees the notes cut
+    record = load_record(fpr_file, 0)
+    record_bis = None
+    if fpr_file_bis is not None:
+        record_bis = load_record(fpr_file_bis, 0)
+
+    if check:
+        report = validate.disc_report(record, record_bis, beat_cut, beat_cut_bis)
+        if not report["ok"]:
+            raise ValueError("Not playable: " + validate.summary(report))
+
+    for side_record, cut in ((record, beat_cut), (record_bis, beat_cut_bis)):
+        if side_record is not None and cut > 0:
+            side_record.resize_beats(cut)
+
+    if to_stl:
+        with open(scad_file, "wb") as myfile:
+            stl.write_stl(myfile, stl.disc_mesh(thickness, record, record_bis))
+        return scad_file
+
+    date_time = datetime.datetime.now().strftime("%d %b %Y %H:%M")
+    with open(scad_file, "w") as myfile:
+        scad.write_scad(
+            myfile,
+            VERSION,
+            date_time,
+            thickness,
+            record,
+            record_bis,
+            compact,
+            precision,
+            title_font,
+        )
+    return scad_file
+
+
+def optional_int(value, default):
+    return int(value) if value not in (None, "") else default
+
+
+def optional_float(value):
+    return float(value) if value not in (None, "") else None
 
-VERSION = "1.0"
-date_time = datetime.datetime.now().strftime("%d %b %Y %H:%M")
-has_second_side = fpr_file_bis is None
 
-scad_output = scad.to_scad(VERSION, date_time, thickness, record, record_bis)
-myfile = open(scad_file, "w")
-myfile.write(scad_output)
-myfile.close()
+def manifest_jobs(manifest):
+    """Read jobs from a .json list of objects or a .csv file with a header line.
+
+    Keys are fpr, fprbis, scad, thickness, beats and beatsbis, only fpr is
+    required. Relative paths are relative to the manifest."""
+    with open(manifest, newline="") as fp:
+        if os.path.splitext(manifest)[1].lower() == ".json":
+            entries = json.load(fp)
+        else:
+            entries = list(csv.DictReader(fp))
+
+    directory = os.path.dirname(manifest)
+    jobs = []
+    for entry in entries:
+        paths = {}
+        for key in ("fpr", "fprbis", "scad"):
+            value = entry.get(key) or None
+            paths[key] = os.path.join(directory, value) if value else None
+        jobs.append(
+            {
+                "fpr_file": paths["fpr"],
+                "fpr_file_bis": paths["fprbis"],
+                "scad_file": paths["scad"],
+                "thickness": optional_float(entry.get("thickness")),
+                "beat_cut": optional_int(entry.get("beats"), const.BEAT_COUNT),
+                "beat_cut_bis": optional_int(entry.get("beatsbis"), const.BEAT_COUNT),
+            }
+        )
+    return jobs
+
+
+def batch_jobs(paths, thickness, beat_cut, outdir, extension=".scad"):
+    """One single sided job per .fpr file found in directories or glob patterns"""
+    jobs = []
+    for fpr_file in batch.find_files(paths):
+        jobs.append(
+            {
+                "fpr_file": fpr_file,
+                "scad_file": batch.output_name(fpr_file, outdir, extension) if outdir else None,
+                "thickness": thickness,
+                "beat_cut": beat_cut,
+            }
+        )
+    return jobs
+
+
+def describe(job):
+    name = job["fpr_file"]
+    if job.get("fpr_file_bis"):
+        name += " + " + job["fpr_file_bis"]
+    return name
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fpr", help="name of fpr file")
+    parser.add_argument("--fprbis", help="name of fpr file for second side")
+    parser.add_argument("--scad", help="name of scad file to output")
+    parser.add_argument(
+        "--thickness", help="thickness in mm. Defaults to 3 if one side or 5 if two sides"
+    )
+    parser.add_argument("--beats",help="number of beats to translate (default:86) 0 => all beats")
+    parser.add_argument("--beatsbis",help="number of beats to translate for second side (default:86) 0 => all beats")
+    parser.add_argument(
+        "--compact",
+        help="write the pins as one data list instead of a pin() call per note",
+        action="store_true",
+    )
+    parser.add_argument("--precision", help="number of decimals of the pin angles")
+    parser.add_argument(
+        "--title-font",
+        nargs="?",
+        const="Letters.dxf",
+        help="write the title glyphs of this Write.scad font (default: Letters.dxf) "
+        "in the scad instead of importing the whole font",
+    )
+    parser.add_argument(
+        "--check",
+        help="check that the disc is playable (see fpr_validate.py) and do not "
+        "convert it when it is not",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--stl",
+        help="write a binary stl of the disc instead of a scad file, without the "
+        "title. It is not one manifold solid but several overlapping closed shells: "
+        "the blank and a box per pin, to be merged by the slicer",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--batch",
+        nargs="+",
+        help="directories or glob patterns of fpr files to convert, one disc per file",
+    )
+    parser.add_argument(
+        "--manifest",
+        help="csv or json file listing discs (fpr, fprbis, scad, thickness, beats, beatsbis)",
+    )
+    parser.add_argument("--outdir", help="directory of the scad files in batch mode")
+    parser.add_argument(
+        "--jobs", help="number of worker processes in batch mode (default: CPU count)"
+    )
+
+    args = parser.parse_args()
+
+    thickness = float(args.thickness) if args.thickness else None
+    beat_cut = const.BEAT_COUNT
+    if args.beats:
+        beat_cut = int(args.beats)
+    beat_cut_bis = const.BEAT_COUNT
+    if args.beatsbis:
+        beat_cut_bis = int(args.beatsbis)
+    precision = int(args.precision) if args.precision else None
+
+    if args.batch or args.manifest:
+        jobs = []
+        if args.manifest:
+            jobs.extend(manifest_jobs(args.manifest))
+        if args.batch:
+            extension = ".stl" if args.stl else ".scad"
+            jobs.extend(
+                batch_jobs(args.batch, thickness, beat_cut, args.outdir, extension)
+            )
+        for job in jobs:
+            job["compact"] = args.compact
+            job["precision"] = precision
+            job["to_stl"] = args.stl
+            job["title_font"] = args.title_font
+            job["check"] = args.check
+        if args.outdir:
+            os.makedirs(args.outdir, exist_ok=True)
+        workers = int(args.jobs) if args.jobs else None
+        sys.exit(1 if batch.run_jobs(convert, jobs, workers, describe) else 0)
+
+    if not args.fpr:
+        parser.error("--fpr is required unless --batch or --manifest is given")
+
+    try:
+        convert(
+            args.fpr,
+            args.fprbis,
+            args.scad,
+            thickness,
+            beat_cut,
+            beat_cut_bis,
+            args.compact,
+            precision,
+            args.stl,
+            args.title_font,
+            args.check,
+        )
+    except FileNotFoundError as e:
+        print(e)
+        sys.exit()
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
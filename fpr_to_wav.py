@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+import os
+import sys
+import argparse
+from pathlib import Path
+import audio
+import batch
+import const
+
+from record import Record
+
+
+def render_file(fpr_file, wav_file=None, wholedisc=False, tempo=1.0,
+                sample_rate=audio.SAMPLE_RATE, raw=False):
+    extension = ".raw" if raw else ".wav"
+    wav_file = wav_file or os.path.splitext(fpr_file)[0] + extension
+    if not Path(fpr_file).is_file():
+        raise FileNotFoundError("Cannot find " + fpr_file)
+
+    record = Record(0, const.TRACK_COUNT)
+    record.filename = fpr_file
+    record.load()
+    period = audio.beat_period(record, wholedisc, tempo)
+    pcm = audio.to_pcm(audio.render(record, period, sample_rate))
+    if raw:
+        audio.write_raw(wav_file, pcm)
+    else:
+        audio.write_wav(wav_file, pcm, sample_rate)
+    return wav_file
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="render fpr files to audio files without a midi port"
+    )
+    parser.add_argument("--fpr", help="name of fpr file")
+    parser.add_argument("--wav", help="name of the audio file to output")
+    parser.add_argument(
+        "--wholedisc",
+        help="play the whole disc in {:g} s instead of {:g} s per beat".format(
+            const.WHOLEDISC_SEC, const.BEAT_SEC
+        ),
+        action="store_true",
+    )
+    parser.add_argument("--tempo", type=float, default=1.0, help="tempo factor (default: 1)")
+    parser.add_argument(
+        "--rate", type=int, default=audio.SAMPLE_RATE,
+        help="sample rate in Hz (default: {})".format(audio.SAMPLE_RATE),
+    )
+    parser.add_argument(
+        "--raw",
+        help="write headerless 16 bits little endian mono samples instead of a wav file",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--batch",
+        nargs="+",
+        help="directories or glob patterns of fpr files to render",
+    )
+    parser.add_argument("--outdir", help="directory of the audio files in batch mode")
+    parser.add_argument(
+        "--jobs", help="number of worker processes in batch mode (default: CPU count)"
+    )
+
+    args = parser.parse_args()
+
+    if args.batch:
+        extension = ".raw" if args.raw else ".wav"
+        jobs = [
+            {
+                "fpr_file": fpr_file,
+                "wav_file": batch.output_name(fpr_file, args.outdir, extension),
+                "wholedisc": args.wholedisc,
+                "tempo": args.tempo,
+                "sample_rate": args.rate,
+                "raw": args.raw,
+            }
+            for fpr_file in batch.find_files(args.batch)
+        ]
+        if args.outdir:
+            os.makedirs(args.outdir, exist_ok=True)
+        workers = int(args.jobs) if args.jobs else None
+        describe = lambda job: job["fpr_file"]
+        sys.exit(1 if batch.run_jobs(render_file, jobs, workers, describe) else 0)
+
+    if not args.fpr:
+        parser.error("--fpr is required unless --batch is given")
+
+    try:
+        render_file(args.fpr, args.wav, args.wholedisc, args.tempo, args.rate, args.raw)
+    except FileNotFoundError as e:
+        print(e)
+        sys.exit()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+import os
+import sys
+import argparse
+import json
+import batch
+import const
+import validate
+
+from record import Record
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="check that fpr files can be played once printed, one json "
+        "report per line"
+    )
+    parser.add_argument(
+        "fpr", nargs="+", help="fpr files, directories or glob patterns of fpr files"
+    )
+    parser.add_argument(
+        "--beats",
+        help="number of beats put on the disc (default:86) 0 => all beats",
+    )
+    parser.add_argument(
+        "--text", help="one line summary per file instead of json", action="store_true"
+    )
+    args = parser.parse_args()
+    beat_cut = int(args.beats) if args.beats else const.BEAT_COUNT
+
+    failed = 0
+    for fpr_file in batch.find_files(args.fpr):
+        if os.path.isfile(fpr_file):
+            record = Record(0, const.TRACK_COUNT)
+            record.filename = fpr_file
+            record.load()
+            report = validate.disc_report(record, beat_cut=beat_cut)
+        else:
+            report = {"ok": False, "error": "Cannot find " + fpr_file, "sides": []}
+        report["fpr"] = fpr_file
+        failed += not report["ok"]
+        if args.text:
+            print("{}: {}".format(fpr_file, report.get("error") or validate.summary(report)))
+        else:
+            print(json.dumps(report))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,125 @@
+import functools
+import json
+import os
+import tempfile
+
+# Glyph outlines of the Write.scad DXF fonts, so titles can be written in the
+# scad as polygons instead of having OpenSCAD import a whole font file.
+# A font is parsed once, its glyphs are then cached on disk, one file per
+# glyph, in a directory named after the font file, its size and its mtime.
+
+FONT_DIR = "writescad"
+DEFAULT_FONT = "Letters.dxf"
+
+
+def cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "music-box-tune-tracker", "glyphs")
+
+
+def layer_name(char):
+    """Layer of a character in the fonts of Write.scad: lower case letters
+    have a trailing underscore"""
+    return char + "_" if "a" <= char <= "z" else char
+
+
+def read_dxf(filename):
+    """Closed polylines of a DXF file as a dict of layer: list of paths"""
+    layers = {}
+    with open(filename) as fp:
+        lines = fp.read().splitlines()
+
+    path = None
+    x = None
+    for code, value in zip(lines[0::2], lines[1::2]):
+        code = code.strip()
+        value = value.strip()
+        if code == "0":
+            path = [] if value == "LWPOLYLINE" else None
+        elif path is None:
+            continue
+        elif code == "8":
+            layers.setdefault(value, []).append(path)
+        elif code == "10":
+            x = float(value)
+        elif code == "20":
+            path.append((x, float(value)))
+    for paths in layers.values():
+        for path in paths:
+            # the first point is repeated to close the outline
+            if len(path) > 1 and path[0] == path[-1]:
+                path.pop()
+    return layers
+
+
+def to_polygon(paths):
+    """Paths as the points and paths arguments of an OpenSCAD polygon()"""
+    points = []
+    indexes = []
+    for path in paths:
+        if len(path) < 3:
+            continue
+        indexes.append(list(range(len(points), len(points) + len(path))))
+        points.extend(path)
+    return [points, indexes]
+
+
+def write_json(filename, data):
+    fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(filename))
+    with os.fdopen(fd, "w") as fp:
+        json.dump(data, fp, separators=(",", ":"))
+    os.replace(tmp_filename, filename)
+
+
+@functools.lru_cache(maxsize=None)
+def font_index(font):
+    """Cache directory of a font and its glyph file numbers by layer name,
+    the cache is filled from the DXF file on first use"""
+    filename = os.path.join(FONT_DIR, font)
+    stat = os.stat(filename)
+    directory = os.path.join(
+        cache_dir(),
+        "{}-{}-{}".format(os.path.basename(font), stat.st_size, stat.st_mtime_ns),
+    )
+    index = os.path.join(directory, "index.json")
+    if not os.path.isfile(index):
+        os.makedirs(directory, exist_ok=True)
+        layers = read_dxf(filename)
+        names = sorted(layers)
+        for number, name in enumerate(names):
+            glyph_filename = os.path.join(directory, "{}.json".format(number))
+            write_json(glyph_filename, to_polygon(layers[name]))
+        write_json(index, names)
+
+    with open(index) as fp:
+        names = json.load(fp)
+    return directory, {name: number for number, name in enumerate(names)}
+
+
+@functools.lru_cache(maxsize=None)
+def get_glyph(font, char):
+    """[points, paths] of a character, None when the font does not have it"""
+    directory, numbers = font_index(font)
+    number = numbers.get(layer_name(char))
+    if number is None:
+        return None
+    with open(os.path.join(directory, "{}.json".format(number))) as fp:
+        return json.load(fp)
+
+
+def title_glyphs(title, font=DEFAULT_FONT):
+    """Distinct glyphs of a title and, for each character, the index of its
+    glyph or -1 when the font has no glyph for it"""
+    glyphs = []
+    indexes = []
+    for char in title:
+        glyph = get_glyph(font, char)
+        if glyph is None or not glyph[0]:
+            indexes.append(-1)
+            continue
+        if glyph not in glyphs:
+            glyphs.append(glyph)
+        indexes.append(glyphs.index(glyph))
+    return glyphs, indexes
@@ -0,0 +1,121 @@
+from array import array
+
+# Undo/redo of the edits of a record. Each edit is kept as a delta packed in
+# one 64 bits integer: its kind, the beat and track it applies to and, for a
+# removed beat, the mask of the notes it had. Titles are kept aside, only a
+# title edit costs more than 8 bytes.
+
+FLIP = 0  # a note reversed
+INSERT = 1  # an empty beat inserted by right_shift
+DELETE = 2  # a beat removed by left_shift, with its mask
+TITLE = 3  # a title change, with the index of the (old, new) titles
+
+_KIND_BITS = 2
+_TRACK_BITS = 6
+_BEAT_BITS = 24
+_VALUE_SHIFT = _KIND_BITS + _TRACK_BITS + _BEAT_BITS
+
+
+def pack(kind, beat_index=0, track_index=0, value=0):
+    return (
+        value << _VALUE_SHIFT
+        | beat_index << _KIND_BITS + _TRACK_BITS
+        | track_index << _KIND_BITS
+        | kind
+    )
+
+
+def unpack(delta):
+    """(kind, beat index, track index, value) of a packed delta"""
+    return (
+        delta & (1 << _KIND_BITS) - 1,
+        delta >> _KIND_BITS + _TRACK_BITS & (1 << _BEAT_BITS) - 1,
+        delta >> _KIND_BITS & (1 << _TRACK_BITS) - 1,
+        delta >> _VALUE_SHIFT,
+    )
+
+
+class History:
+    """Edits a record and remembers how to undo them. undo() and redo() return
+    the unpacked delta they applied, so the caller can redraw only what
+    changed, or None when there is nothing to undo or redo."""
+
+    record = None
+    journal = None  # when set, every change of the record is appended to it
+
+    def __init__(self, record):
+        self.record = record
+        self.__undo = array("Q")
+        self.__redo = array("Q")
+        self.__titles = []
+
+    def __push(self, delta):
+        self.__undo.append(delta)
+        del self.__redo[:]
+
+    def __change(self, operation, *args):
+        if operation == "title":
+            self.record.title = args[0]
+            result = None
+        else:
+            result = getattr(self.record, operation)(*args)
+        if self.journal is not None:
+            self.journal.append(operation, *args)
+        return result
+
+    def reverse_note(self, beat_index, track_index):
+        self.__change("reverse_note", beat_index, track_index)
+        self.__push(pack(FLIP, beat_index, track_index))
+
+    def right_shift(self, beat_index):
+        self.__change("right_shift", beat_index)
+        self.__push(pack(INSERT, beat_index))
+
+    def left_shift(self, beat_index):
+        mask = self.__change("left_shift", beat_index)
+        self.__push(pack(DELETE, beat_index, value=mask))
+
+    def set_title(self, title):
+        if title == self.record.title:
+            return
+        self.__titles.append((self.record.title, title))
+        self.__change("title", title)
+        self.__push(pack(TITLE, value=len(self.__titles) - 1))
+
+    def clear(self):
+        """Forget the history, e.g. when the record is reloaded"""
+        del self.__undo[:]
+        del self.__redo[:]
+        self.__titles.clear()
+
+    def __apply(self, delta, undo):
+        kind, beat_index, track_index, value = unpack(delta)
+        if kind == FLIP:
+            self.__change("reverse_note", beat_index, track_index)
+        elif kind == INSERT:
+            if undo:
+                self.__change("undo_right_shift", beat_index)
+            else:
+                self.__change("right_shift", beat_index)
+        elif kind == DELETE:
+            if undo:
+                self.__change("undo_left_shift", beat_index, value)
+            else:
+                self.__change("left_shift", beat_index)
+        else:
+            self.__change("title", self.__titles[value][0 if undo else 1])
+        return kind, beat_index, track_index, value
+
+    def undo(self):
+        if not self.__undo:
+            return None
+        delta = self.__undo.pop()
+        self.__redo.append(delta)
+        return self.__apply(delta, True)
+
+    def redo(self):
+        if not self.__redo:
+            return None
+        delta = self.__redo.pop()
+        self.__undo.append(delta)
+        return self.__apply(delta, False)
@@ -14,15 +14,23 @@ class Input:
     record = None
     tone_descending = True
     wholedisc = False
+    tempo = 1.0  # playback speed ratio
+    loop = False  # restart playback from player_start_at at the end
+    jitter = None  # timing summary of the last playback
     window = None
 
     display_from = 0
 
+    # what is displayed
+    NOTE_CH = "•"
+    EMPTY_CH = "_"
+
     def __init__(self, record=None, window=None):
         self.record = record
         if record and self.beats_count > record.beats_count:
             self.beats_count = record.beats_count
         self.window = window
+        self.__displayed = None  # row masks of the notes on screen, None to repaint
 
     def __draw_tone(self, track_index, tone_str):
         self.window.addstr(
@@ -32,22 +40,90 @@ class Input:
         )
 
     def draw_beat_index(self):
-        for beat_index in range(0, self.beats_count):
-            y = self.start_y + self.offset_y + self.tracks_count + 1
-            beat_index_str = str(beat_index + 1 + self.display_from).rjust(3,' ')
-            for beat_index_str_index in range(len(beat_index_str)):
-                self.window.addstr(
-                    y + beat_index_str_index,
-                    self.start_x + self.offset_x + beat_index,
-                    beat_index_str[beat_index_str_index],
-                )
+        # one line per digit, beat numbers are written vertically
+        y = self.start_y + self.offset_y + self.tracks_count + 1
+        width = max(3, len(str(self.display_from + self.beats_count)))
+        beat_index_strs = [
+            str(beat_index + 1 + self.display_from).rjust(width, " ")
+            for beat_index in range(self.beats_count)
+        ]
+        for digit_index in range(width):
+            self.window.addstr(
+                y + digit_index,
+                self.start_x + self.offset_x,
+                "".join([index_str[digit_index] for index_str in beat_index_strs]),
+            )
 
-    def draw_partition(self):
-        """Read parition and populate the screen"""
-        # what is displayed
-        NOTE_CH = "•"
-        EMPTY_CH = "_"
+    def invalidate(self):
+        """Forget what is on screen, the next draw_partition repaints every cell"""
+        self.__displayed = None
+
+    def __row_masks(self):
+        """Notes on screen as one mask per row, bit n set for a note at column n"""
+        row_masks = [0] * self.tracks_count
+        last = min(self.display_from + self.beats_count, self.record.beats_count)
+        for beat_index in range(self.display_from, last):
+            mask = self.record.get_mask(beat_index)
+            column_bit = 1 << (beat_index - self.display_from)
+            while mask:
+                bit = mask & -mask
+                row_masks[self.__row(bit.bit_length() - 1)] |= column_bit
+                mask ^= bit
+        return row_masks
+
+    def __row(self, track_index):
+        if self.tone_descending:
+            return self.tracks_count - 1 - track_index
+        return track_index
 
+    def __empty_attr(self, column):
+        # the empty cells are striped by column
+        pair = const.PAIR_INPUT_A if column % 2 == 0 else const.PAIR_INPUT_B
+        return curses.color_pair(pair)
+
+    def __draw_background(self):
+        """Empty every cell, a column at a time as all its cells look the same"""
+        y = self.start_y + self.offset_y
+        for column in range(self.beats_count):
+            self.window.vline(
+                y,
+                self.start_x + self.offset_x + column,
+                ord(self.EMPTY_CH) | self.__empty_attr(column),
+                self.tracks_count,
+            )
+
+    def __draw_notes(self, row, mask):
+        """Draw the notes of a row at the columns set in mask, each run of
+        consecutive notes at once"""
+        attr = curses.color_pair(const.PAIR_NOTE)
+        while mask:
+            run_start = (mask & -mask).bit_length() - 1
+            shifted = mask >> run_start
+            run_length = (shifted ^ (shifted + 1)).bit_length() - 1
+            self.window.addstr(
+                self.start_y + self.offset_y + row,
+                self.start_x + self.offset_x + run_start,
+                self.NOTE_CH * run_length,
+                attr,
+            )
+            mask &= ~(((1 << run_length) - 1) << run_start)
+
+    def __draw_empty(self, row, mask):
+        """Empty the cells of a row at the columns set in mask"""
+        while mask:
+            bit = mask & -mask
+            column = bit.bit_length() - 1
+            self.window.addstr(
+                self.start_y + self.offset_y + row,
+                self.start_x + self.offset_x + column,
+                self.EMPTY_CH,
+                self.__empty_attr(column),
+            )
+            mask ^= bit
+
+    def draw_partition(self):
+        """Read parition and populate the screen, only the cells which changed
+        since the last draw are written"""
         # scroll indicators
         self.window.move(self.start_y, self.start_x)
         if self.display_from > 0:
@@ -60,46 +136,50 @@ class Input:
         else:
             self.window.addch("┐")
 
-        tracks_range = range(self.tracks_count)
-        for track_index in tracks_range:
-            for beat_index in range(self.beats_count):
-                self.window.move(
-                    self.start_y + self.offset_y + track_index,
-                    self.start_x + self.offset_x + beat_index,
-                )
-                attr = None
-                ch = None
-                if self.tone_descending:
-                    track_index = self.tracks_count - 1 - track_index
-
-                if self.record.has_note(self.display_from + beat_index, track_index):
-                    attr = curses.color_pair(const.PAIR_NOTE)
-                    ch = NOTE_CH
-                else:
-                    ch = EMPTY_CH
-                    pair = None
-                    if beat_index % 2 == 0:
-                        pair = const.PAIR_INPUT_A
-                    else:
-                        pair = const.PAIR_INPUT_B
-                    attr = curses.color_pair(pair)
-
-                self.window.attron(attr)
-                self.window.addch(ch)
-                self.window.attroff(attr)
+        row_masks = self.__row_masks()
+        if self.__displayed is not None:
+            emptied = [old & ~new for old, new in zip(self.__displayed, row_masks)]
+            # striped empty cells are written one by one, past a column of them
+            # it is cheaper to start again from the background
+            if sum(bin(mask).count("1") for mask in emptied) <= self.beats_count:
+                for row, (old, new) in enumerate(zip(self.__displayed, row_masks)):
+                    self.__draw_empty(row, emptied[row])
+                    self.__draw_notes(row, new & ~old)
+                self.__displayed = row_masks
+                return
+        self.__draw_background()
+        for row, mask in enumerate(row_masks):
+            self.__draw_notes(row, mask)
+        self.__displayed = row_masks
+
+    def draw_note(self, beat_index, track_index):
+        """Redraw the cell of a single note, e.g. after reverse_note"""
+        column = beat_index - self.display_from
+        if self.__displayed is None or not 0 <= column < self.beats_count:
+            self.draw_partition()
+            return
+        row = self.__row(track_index)
+        column_bit = 1 << column
+        if self.record.has_note(beat_index, track_index):
+            self.__displayed[row] |= column_bit
+            self.__draw_notes(row, column_bit)
+        else:
+            self.__displayed[row] &= ~column_bit
+            self.__draw_empty(row, column_bit)
 
     def draw_player_start_at(self, play_beat=-1):
         y = self.tracks_count + self.offset_y + self.start_y
         sx = self.player_start_at + self.offset_x - self.display_from
         px = play_beat + self.offset_x - self.display_from
+        line = ""
         for x in range(self.start_x + self.offset_x, self.start_x + self.offset_x + self.beats_count):
-            self.window.move(y, x)
             if x == sx:
-                self.window.addch("▲")
+                line += "▲"
             elif x > sx and x <= px:
-                self.window.addch("△")
+                line += "△"
             else:
-                self.window.addch("─")
+                line += "─"
+        self.window.addstr(y, self.start_x + self.offset_x, line)
 
     def draw_tones(self, cursor_y):
         # draw tones TODO parametrable tones
@@ -134,6 +214,7 @@ class Input:
 
 
     def draw(self, cursor_x, cursor_y):
+        self.invalidate()
         # draw border
         rectangle(
             self.window,
@@ -143,16 +224,30 @@ class Input:
             self.beats_count + self.offset_x + self.start_x,
         )
 
-        # title
-        if self.record.title is not None:
-            self.window.addstr(self.start_y, self.start_x + 2, self.record.title)
-
         # draw various parts
+        self.draw_title()
         self.draw_partition()
         self.draw_player_start_at()
         self.draw_beat_index()
         self.draw_tones(cursor_y)
 
+    def draw_title(self):
+        # the title is written over the top border, which also clears the old one
+        self.window.hline(
+            self.start_y,
+            self.start_x + 1,
+            curses.ACS_HLINE,
+            self.beats_count + self.offset_x - 1,
+        )
+        if self.record.title is not None:
+            self.window.addstr(self.start_y, self.start_x + 2, self.record.title)
+
+    def draw_status(self, status):
+        y = self.start_y + self.offset_y + self.tracks_count + 5
+        self.window.move(y, self.start_x)
+        self.window.clrtoeol()
+        self.window.addstr(y, self.start_x, status)
+
     def can_move(self, y, x):
         return (
             y > self.start_y
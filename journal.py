@@ -0,0 +1,257 @@
+import hashlib
+import io
+import os
+import struct
+import sys
+import tempfile
+import threading
+
+from record import Record, file_mode
+
+# Autosave of the edits of a record: each change is appended to a journal next
+# to the .fpr file, a background thread writes and fsyncs them in small
+# batches. When the tracker starts again after a crash, the journal is
+# replayed over the .fpr. From time to time the record is saved and the
+# journal started again, empty. Quitting removes the journal, the edits not
+# saved are dropped as before. When the journal cannot be written (e.g. in a
+# read only directory) the record is edited without it.
+#
+# The journal begins with the sha1 of the record it applies to, as read back
+# from a .fpr file, so a journal left behind by an interrupted compaction is
+# never replayed over the newer .fpr, nor over a record imported from a .mid.
+
+MAGIC = b"FPRJ"
+FLUSH_SEC = 0.5
+COMPACT_EDITS = 500
+
+# record changes that can be journaled, the index in this list is the opcode
+OPERATIONS = [
+    "reverse_note",  # beat, track
+    "right_shift",  # beat
+    "left_shift",  # beat
+    "undo_right_shift",  # beat
+    "undo_left_shift",  # beat, mask
+    "title",  # new title
+]
+_ENTRY = struct.Struct("<BIBI")  # opcode, beat, track, mask
+_TITLE_LENGTH = struct.Struct("<I")
+
+
+def journal_name(filename):
+    return filename + ".journal"
+
+
+def record_digest(record):
+    # the digest of the record as it is read back from its .fpr, which does
+    # not keep everything (e.g. spaces at the end of the title), so that a
+    # saved record and the same record loaded again have the same one
+    loaded = Record(0, record.tracks_count)
+    loaded.read(io.StringIO(record.to_fpr()))
+    return hashlib.sha1(loaded.to_fpr().encode("utf-8")).digest()
+
+
+def encode(operation, *args):
+    opcode = OPERATIONS.index(operation)
+    if operation == "title":
+        title = args[0].encode("utf-8")
+        return _ENTRY.pack(opcode, 0, 0, 0) + _TITLE_LENGTH.pack(len(title)) + title
+    beat_index = args[0]
+    track_index = args[1] if operation == "reverse_note" else 0
+    mask = args[1] if operation == "undo_left_shift" else 0
+    return _ENTRY.pack(opcode, beat_index, track_index, mask)
+
+
+def apply(record, operation, args):
+    if operation == "title":
+        record.title = args[0]
+    else:
+        getattr(record, operation)(*args)
+
+
+def read_entries(data, offset):
+    """(operation, args, end offset) of the entries of a journal, up to the
+    first incomplete one"""
+    while offset + _ENTRY.size <= len(data):
+        opcode, beat_index, track_index, mask = _ENTRY.unpack_from(data, offset)
+        end = offset + _ENTRY.size
+        if opcode >= len(OPERATIONS):
+            return
+        operation = OPERATIONS[opcode]
+        if operation == "title":
+            if end + _TITLE_LENGTH.size > len(data):
+                return
+            (length,) = _TITLE_LENGTH.unpack_from(data, end)
+            end += _TITLE_LENGTH.size
+            if end + length > len(data):
+                return
+            args = (data[end : end + length].decode("utf-8", "replace"),)
+            end += length
+        elif operation == "reverse_note":
+            args = (beat_index, track_index)
+        elif operation == "undo_left_shift":
+            args = (beat_index, mask)
+        else:
+            args = (beat_index,)
+        yield operation, args, end
+        offset = end
+
+
+class Journal:
+    """Journal of the record, made right after the record is loaded or
+    imported and started by recover(), once the record is ready to edit"""
+
+    record = None
+    filename = None
+    edits = 0  # entries in the journal
+    stale = None  # where a journal of another content was moved by recover()
+    error = None  # why there is no journal, None while journaling works
+
+    def __init__(self, record):
+        self.record = record
+        self.filename = journal_name(record.filename)
+        self.__lock = threading.Lock()
+        self.__pending = bytearray()
+        self.__fp = None
+        self.__stop = threading.Event()
+        self.__thread = None
+        self.__written = False  # the journal file is ours, to remove when closed
+        self.__base = record_digest(record)
+
+    def recover(self):
+        """Replay the journal left over the record, if it was started from the
+        same content, then keep journaling. Returns the number of edits
+        replayed."""
+        replayed = 0
+        valid_length = 0
+        try:
+            with open(self.filename, "rb") as fp:
+                data = fp.read()
+        except FileNotFoundError:
+            data = b""
+        except OSError as e:
+            self.__disable(e)
+            return replayed
+        header = MAGIC + self.__base
+        if data.startswith(header):
+            valid_length = len(header)
+            for operation, args, end in read_entries(data, len(header)):
+                apply(self.record, operation, args)
+                replayed += 1
+                valid_length = end
+
+        try:
+            if data and not valid_length:
+                # never drop edits silently: keep the journal aside
+                self.stale = self.filename + ".old"
+                os.replace(self.filename, self.stale)
+                print(
+                    "warning: {} does not apply to {}, moved to {}".format(
+                        self.filename, self.record.filename, self.stale
+                    ),
+                    file=sys.stderr,
+                )
+            if valid_length:
+                # drop a partly written last entry, new ones are appended after
+                self.__fp = open(self.filename, "r+b")
+                self.__written = True
+                self.__fp.truncate(valid_length)
+                self.__fp.seek(valid_length)
+            else:
+                self.__start(self.__base)
+        except OSError as e:
+            self.__disable(e)
+            return replayed
+        self.edits = replayed
+        self.__thread = threading.Thread(target=self.__flush_loop, daemon=True)
+        self.__thread.start()
+        return replayed
+
+    def __start(self, digest):
+        # new journal of the content with this digest, replacing the old one atomically
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        fd, tmp_filename = tempfile.mkstemp(
+            prefix=".", suffix=".journal.tmp", dir=directory
+        )
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(MAGIC + digest)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.chmod(tmp_filename, file_mode(self.filename))
+        os.replace(tmp_filename, self.filename)
+        self.__written = True
+        if self.__fp is not None:
+            self.__fp.close()
+        self.__fp = open(self.filename, "ab")
+        self.edits = 0
+
+    def __disable(self, error):
+        # keep editing without a journal
+        self.error = "no autosave journal: {}".format(error.strerror or error)
+        if self.__fp is not None:
+            try:
+                self.__fp.close()
+            except OSError:
+                pass
+            self.__fp = None
+        del self.__pending[:]
+
+    def append(self, operation, *args):
+        with self.__lock:
+            if self.__fp is not None:
+                self.__pending += encode(operation, *args)
+                self.edits += 1
+
+    def flush(self):
+        with self.__lock:
+            if self.__pending:
+                try:
+                    self.__fp.write(self.__pending)
+                    self.__fp.flush()
+                    os.fsync(self.__fp.fileno())
+                except OSError as e:
+                    self.__disable(e)
+                del self.__pending[:]
+
+    def __flush_loop(self):
+        while not self.__stop.wait(FLUSH_SEC):
+            self.flush()
+
+    def needs_compaction(self):
+        return self.__fp is not None and self.edits >= COMPACT_EDITS
+
+    def compact(self):
+        """Save the record and start an empty journal"""
+        with self.__lock:
+            del self.__pending[:]
+            self.record.save()
+            if self.__fp is not None:
+                self.__restart()
+
+    def reset(self):
+        """Forget the edits, e.g. when the record is loaded again"""
+        with self.__lock:
+            del self.__pending[:]
+            if self.__fp is not None:
+                self.__restart()
+
+    def __restart(self):
+        try:
+            self.__start(record_digest(self.record))
+        except OSError as e:
+            self.__disable(e)
+
+    def close(self):
+        """Stop journaling and remove the journal, only a crash leaves one"""
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+        with self.__lock:
+            del self.__pending[:]
+            if self.__fp is not None:
+                self.__fp.close()
+                self.__fp = None
+            if self.__written:
+                try:
+                    os.remove(self.filename)
+                except OSError:
+                    pass
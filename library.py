@@ -0,0 +1,149 @@
+import mmap
+import os
+import struct
+import tempfile
+
+from record import Record, file_mode
+
+# Many records in one binary file: a header, an index with the beat count of
+# each record and where its strings and partition are, the strings (names,
+# titles and comments in utf-8) and the partitions, 16 bits per beat.
+# The file is read through mmap, opening a library only reads its header, a
+# record is decoded when it is asked for.
+
+MAGIC = b"FPRL"
+VERSION = 1
+# magic, version, tracks count, records count, offset of the strings
+_HEADER = struct.Struct("<4sHHIQ")
+# partition offset, beats count, then offset and length in the strings of the
+# name, the title and the comment
+_ENTRY = struct.Struct("<QIIIIIII")
+
+
+def write_library(filename, records):
+    """Write records (with a filename, its basename is their name) to a
+    library, atomically. Names must be unique, as records are found and
+    unpacked by name."""
+    tracks_count = max((record.tracks_count for record in records), default=16)
+    filenames = {}
+    for record in records:
+        name = os.path.basename(record.filename or "")
+        if name in filenames:
+            raise ValueError(
+                "{} and {} have the same name {}".format(filenames[name], record.filename, name)
+            )
+        filenames[name] = record.filename
+
+    strings = bytearray()
+    string_fields = []
+    for record in records:
+        fields = []
+        for text in (os.path.basename(record.filename or ""), record.title, record.comment):
+            data = (text or "").encode("utf-8")
+            fields += [len(strings), len(data)]
+            strings += data
+        string_fields.append(fields)
+
+    strings_offset = _HEADER.size + _ENTRY.size * len(records)
+    partition_offset = strings_offset + len(strings)
+    partition_offset += partition_offset % 2
+    partitions = []
+    index = bytearray()
+    for record, fields in zip(records, string_fields):
+        partition = record.to_buffer()
+        index += _ENTRY.pack(partition_offset, record.beats_count, *fields)
+        partitions.append(partition)
+        partition_offset += len(partition)
+
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, tmp_filename = tempfile.mkstemp(prefix=".", suffix=".fprl.tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(_HEADER.pack(MAGIC, VERSION, tracks_count, len(records), strings_offset))
+            fp.write(index)
+            fp.write(strings)
+            if fp.tell() % 2:
+                fp.write(b"\0")
+            fp.writelines(partitions)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.chmod(tmp_filename, file_mode(filename))
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        os.unlink(tmp_filename)
+        raise
+
+
+class Library:
+    """Read only access to a library file, usable as a context manager"""
+
+    filename = None
+    tracks_count = 0
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as fp:
+            self.__map = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.__map) < _HEADER.size:
+            self.close()
+            raise ValueError("not a record library")
+        magic, version, self.tracks_count, self.__count, self.__strings = (
+            _HEADER.unpack_from(self.__map)
+        )
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError("not a record library, or of another version")
+
+    def __len__(self):
+        return self.__count
+
+    def __entry(self, index):
+        if not 0 <= index < self.__count:
+            raise IndexError("record index out of range")
+        return _ENTRY.unpack_from(self.__map, _HEADER.size + index * _ENTRY.size)
+
+    def __string(self, offset, length):
+        start = self.__strings + offset
+        return self.__map[start : start + length].decode("utf-8")
+
+    def name(self, index):
+        return self.__string(*self.__entry(index)[2:4])
+
+    def title(self, index):
+        return self.__string(*self.__entry(index)[4:6])
+
+    def comment(self, index):
+        return self.__string(*self.__entry(index)[6:8])
+
+    def beats_count(self, index):
+        return self.__entry(index)[1]
+
+    def find(self, name):
+        """Index of the record of this name, -1 when there is none"""
+        for index in range(self.__count):
+            if self.name(index) == name:
+                return index
+        return -1
+
+    def record(self, index):
+        partition_offset, beats_count, *fields = self.__entry(index)
+        end = partition_offset + beats_count * 2
+        with memoryview(self.__map)[partition_offset:end] as view:
+            record = Record.from_buffer(
+                view,
+                beats_count,
+                self.tracks_count,
+                self.__string(*fields[2:4]),
+                self.__string(*fields[4:6]),
+            )
+        record.filename = self.__string(*fields[0:2])
+        return record
+
+    def close(self):
+        self.__map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -3,7 +3,9 @@
 import sys
 import argparse
 import os
-from mido import MidiFile, tempo2bpm
+import autofit
+import batch
+import midi
 from record import Record
 import const
 import math
@@ -21,123 +23,161 @@ import math
 # The 'Kikkerland 15' is a musical stave below the Fisher Price Record Player, so all the
 # note have an offset of 12 midi tone
 
-# Limitations
-# To fit on a Fisher Price Record, the conversion will only convert the first 86 beats.
-# This converter do not check tempo, when a midi message has a time above zero, it move to
-# the next beat
+# Timing
+# The beat of a note is its time in seconds scaled by the ratio of the bpm of the song
+# (the last tempo seen, or --bpm) to the bpm of the record
 
 FPR_SEC_BETWEEN_BEATS = 0.25
 FPR_BPM = 60 / FPR_SEC_BETWEEN_BEATS
+OFFSET = 12
+DEFAULT_TEMPO = 500000  # microseconds per quarter note until a set_tempo
 
-parser = argparse.ArgumentParser()
-parser.add_argument(
-    "--mid",
-    help="mid file to import from musicboxmaniacs.com (Kikkerland 15 only)",
-    required=True,
-)
-parser.add_argument(
-    "--fpr",
-    help="fpr file to write. When not present, the output file will have the same name as the mid input but with .frp extension",
-)
-parser.add_argument(
-    "--bpm",
-    help="set bpm of mid file. When not present, the bmp will be read from the mid file",
-)
-parser.add_argument(
-    "--stdout",
-    help="do not save output to a file but print to stdout instead",
-    action="store_true",
-)
-parser.add_argument(
-    "--verbose",
-    help="show MIDI message information during conversion",
-    action="store_true",
-)
-
-args = parser.parse_args()
-filename = args.mid
-
-def log(msg, nonl=False):
-    if args.verbose:
-        print(msg, end='' if nonl else '\n')
-
-record = Record(0, const.TRACK_COUNT)
-offset = 12
-track_index = 0
-beat_index = 0
-total_time = 0
-bpm = float(args.bpm) if args.bpm else None
-speed_ratio = 1
-if bpm is not None:
-    speed_ratio = bpm / FPR_BPM
-    log(f"bpm={bpm} ratio={speed_ratio}")
-
-for msg in MidiFile(filename):
-
-    if msg.type == "set_tempo":
-        if bpm is not None:
-            continue
-
-        ms_per_beat = msg.tempo
-        bpm = tempo2bpm(ms_per_beat)
+
+def read_notes(mid_file, bpm=None, log=lambda msg: None):
+    """Positions in beats of the record, before rounding, and midi notes of the
+    note_on events, and the bpm of the song"""
+    speed_ratio = 1
+    if bpm is not None:
         speed_ratio = bpm / FPR_BPM
-        log(f"ms_per_beat={ms_per_beat} bpm={bpm} ratio={speed_ratio}")
-
-        continue
-
-    if msg.is_meta:
-        continue
-
-    total_time += msg.time
-    beat_index = math.ceil(total_time / speed_ratio)
-    log(f"msg.time={msg.time} beat_index={beat_index} msg.type={msg.type}: ", True)
-
-    if msg.type == "note_on":
-        note = msg.note + offset
-        nabv = note
-        nbel = note
-        # search for suitable higher/lower note if we don't have the one specified..
-        while not note in record.NOTES:
-            nabv += 1
-            nbel -= 1
-            # prefer higher notes than lower?
-            if nabv in record.NOTES:
-                note = nabv
-                break
-            elif nbel in record.NOTES:
-                note = nbel
-                break
-        if note != msg.note + offset:
-            log(f"note_on={msg.note+offset}>{note} ", True)
-        else:
-            log(f"note_on={note} ", True)
-
-        # resize partition
-        diff_beat = (beat_index - record.beats_count) + 1
-        for _ in range(diff_beat):
-            record.right_shift(beat_index)
-
-        # find track and set note
-        track_index = record.NOTES.index(note)
-        record.set_note(beat_index, track_index, True)
-
-    log("")
-
-if args.fpr:
-    record.filename = args.fpr
-else:
-    record.filename = os.path.splitext(filename)[0] + ".fpr"
-
-basename = os.path.basename(filename)
-record.title = os.path.splitext(basename)[0]
-record.comment = """Imported from
+        log(f"bpm={bpm} ratio={speed_ratio}")
+    fixed_bpm = bpm is not None
+
+    tempo = DEFAULT_TEMPO
+    last_tick = 0
+    total_time = 0
+    positions = []
+    notes = []
+    with open(mid_file, "rb") as fp:
+        ticks_per_beat, events = midi.read_events(fp)
+        for tick, status, data1, data2 in events:
+            total_time += (tick - last_tick) * tempo / (1e6 * ticks_per_beat)
+            last_tick = tick
+
+            if status == midi.META:
+                if data1 == midi.META_SET_TEMPO:
+                    tempo = int.from_bytes(data2, "big")
+                    if not fixed_bpm:
+                        bpm = 60e6 / tempo
+                        speed_ratio = bpm / FPR_BPM
+                        log(f"ms_per_beat={tempo} bpm={bpm} ratio={speed_ratio}")
+                continue
+
+            if status & 0xF0 == midi.NOTE_ON and data2:
+                positions.append(total_time / speed_ratio)
+                notes.append(data1)
+    return positions, notes, bpm
+
+
+def convert(mid_file, fpr_file=None, bpm=None, stdout=False, verbose=False, fit=False):
+    def log(msg, nonl=False):
+        if verbose:
+            print(msg, end='' if nonl else '\n')
+
+    record = Record(0, const.TRACK_COUNT)
+    positions, notes, bpm = read_notes(mid_file, bpm, log)
+    fitting = autofit.Fit(OFFSET, 1.0, 0.0)
+    if fit:
+        fitting = autofit.search(positions, notes, record.NOTES, OFFSET)
+        log("offset={} tempo={:g} phase={:g}".format(*fitting))
+    offset, tempo_factor, phase = fitting
+
+    track_of_note = midi.nearest_note_table(record.NOTES, offset)
+    partition = []  # beat masks, grown as the notes come and set once at the end
+    for position, note in zip(positions, notes):
+        beat_index = math.ceil(position * tempo_factor - phase)
+        track_index = track_of_note[note]
+        log(f"beat_index={beat_index} note_on={note + offset}>{record.NOTES[track_index]}")
+        if beat_index >= len(partition):
+            partition.extend([0] * (beat_index + 1 - len(partition)))
+        partition[beat_index] |= 1 << track_index
+
+    record.resize_beats(len(partition))
+    for beat_index, mask in enumerate(partition):
+        if mask:
+            record.set_mask(beat_index, mask)
+
+    record.filename = fpr_file or os.path.splitext(mid_file)[0] + ".fpr"
+    basename = os.path.basename(mid_file)
+    record.title = os.path.splitext(basename)[0]
+    record.comment = """Imported from
 {}
 with a bpm of {}""".format(
-    os.path.basename(filename), bpm
-)
-
-if args.stdout:
-    sys.stdout.write(record.to_fpr())
-else:
-    record.save()
-    print("fpr saved to " + record.filename)
+        os.path.basename(mid_file), bpm
+    )
+    if fit:
+        record.comment += "\ntransposed by {} semitones, tempo x{:g}, phase {:g}".format(
+            offset, tempo_factor, phase
+        )
+
+    if stdout:
+        record.write(sys.stdout)
+    else:
+        record.save()
+    return record.filename
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--mid",
+        help="mid file to import from musicboxmaniacs.com (Kikkerland 15 only)",
+    )
+    parser.add_argument(
+        "--fpr",
+        help="fpr file to write. When not present, the output file will have the same name as the mid input but with .frp extension",
+    )
+    parser.add_argument(
+        "--bpm",
+        help="set bpm of mid file. When not present, the bmp will be read from the mid file",
+    )
+    parser.add_argument(
+        "--stdout",
+        help="do not save output to a file but print to stdout instead",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--verbose",
+        help="show MIDI message information during conversion",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--autofit",
+        help="choose the transposition, tempo and rounding of the beats that fit "
+        "the notes of the record player best, instead of the Kikkerland 15 offset",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--batch",
+        nargs="+",
+        help="directories or glob patterns of mid files to convert, one fpr per file",
+    )
+    parser.add_argument("--outdir", help="directory of the fpr files in batch mode")
+    parser.add_argument(
+        "--jobs", help="number of worker processes in batch mode (default: CPU count)"
+    )
+
+    args = parser.parse_args()
+    bpm = float(args.bpm) if args.bpm else None
+
+    if args.batch:
+        jobs = [
+            {
+                "mid_file": mid_file,
+                "fpr_file": batch.output_name(mid_file, args.outdir, ".fpr"),
+                "bpm": bpm,
+                "fit": args.autofit,
+            }
+            for mid_file in batch.find_files(args.batch, "*.mid")
+        ]
+        if args.outdir:
+            os.makedirs(args.outdir, exist_ok=True)
+        workers = int(args.jobs) if args.jobs else None
+        describe = lambda job: job["mid_file"]
+        sys.exit(1 if batch.run_jobs(convert, jobs, workers, describe) else 0)
+
+    if not args.mid:
+        parser.error("--mid is required unless --batch is given")
+
+    fpr_file = convert(args.mid, args.fpr, bpm, args.stdout, args.verbose, args.autofit)
+    if not args.stdout:
+        print("fpr saved to " + fpr_file)
@@ -0,0 +1,203 @@
+import heapq
+import struct
+
+# Streaming reader of standard midi files. Unlike mido.MidiFile, which parses
+# every track in memory and merges them in seconds, the events are read lazily
+# from the file a chunk at a time and merged in ticks, so the memory used does
+# not depend on the size of the file.
+
+CHUNK_SIZE = 4096
+
+NOTE_OFF = 0x80
+NOTE_ON = 0x90
+META = 0xFF
+META_END_OF_TRACK = 0x2F
+META_SET_TEMPO = 0x51
+
+# data bytes following each channel message status, by high nibble
+_DATA_LENGTH = {0x8: 2, 0x9: 2, 0xA: 2, 0xB: 2, 0xC: 1, 0xD: 1, 0xE: 2}
+
+
+def note_table(notes):
+    """Lookup table of the 128 midi notes: index of the note in notes, -1 when
+    it is not there"""
+    table = [-1] * 128
+    for index, note in enumerate(notes):
+        table[note] = index
+    return table
+
+
+def nearest_note_table(notes, offset=0):
+    """Index in notes of each of the 128 midi notes once shifted by offset: of
+    the note itself, else of the nearest one, the higher one on a tie"""
+    table = []
+    for midi_note in range(128):
+        note = midi_note + offset
+        distance = 0
+        while note + distance not in notes and note - distance not in notes:
+            distance += 1
+        if note + distance in notes:
+            table.append(notes.index(note + distance))
+        else:
+            table.append(notes.index(note - distance))
+    return table
+
+
+def _track_bytes(fp, position, length):
+    # bytes of a track chunk, several readers share fp so each one seeks first
+    end = position + length
+    while position < end:
+        fp.seek(position)
+        chunk = fp.read(min(CHUNK_SIZE, end - position))
+        if not chunk:
+            raise ValueError("truncated midi track")
+        position += len(chunk)
+        yield from chunk
+
+
+def _track_events(fp, position, length):
+    """(tick, status, data1, data2) of a track; meta events have META as
+    status, their type as data1 and their data as data2"""
+    data = _track_bytes(fp, position, length)
+    tick = 0
+    status = 0
+    try:
+        for byte in data:
+            delta = byte & 0x7F
+            while byte & 0x80:
+                byte = next(data)
+                delta = delta << 7 | byte & 0x7F
+            tick += delta
+
+            byte = next(data)
+            if byte == META:
+                meta_type = next(data)
+                meta_data = bytes([next(data) for _ in range(_read_varlen(data))])
+                if meta_type == META_END_OF_TRACK:
+                    return
+                yield tick, META, meta_type, meta_data
+            elif byte in (0xF0, 0xF7):
+                # sysex, skipped
+                for _ in range(_read_varlen(data)):
+                    next(data)
+            elif byte >= 0xF0:
+                # system common and real time messages have no place in a file
+                raise ValueError("unsupported status 0x{:02X}".format(byte))
+            else:
+                if byte & 0x80:
+                    status = byte
+                    data1 = next(data)
+                elif status:
+                    # running status: this is already the first data byte
+                    data1 = byte
+                else:
+                    raise ValueError("midi data byte without a status")
+                if _DATA_LENGTH[status >> 4] == 2:
+                    yield tick, status, data1, next(data)
+                else:
+                    yield tick, status, data1, None
+    except StopIteration:
+        raise ValueError("truncated midi track") from None
+
+
+def _read_varlen(data):
+    value = 0
+    for byte in data:
+        value = value << 7 | byte & 0x7F
+        if not byte & 0x80:
+            break
+    return value
+
+
+def read_header(fp):
+    """(format, tracks count, ticks per quarter note) of a midi file"""
+    chunk_header = fp.read(8)
+    if len(chunk_header) < 8:
+        raise ValueError("not a midi file")
+    chunk_type, length = struct.unpack(">4sI", chunk_header)
+    header = fp.read(length)
+    if chunk_type != b"MThd" or length < 6 or len(header) < 6:
+        raise ValueError("not a midi file")
+    midi_format, tracks_count, division = struct.unpack(">HHH", header[:6])
+    if division & 0x8000:
+        raise ValueError("smpte time division is not supported")
+    return midi_format, tracks_count, division
+
+
+def read_events(fp):
+    """Ticks per quarter note and an iterator over the (tick, status, data1,
+    data2) events of all the tracks of a binary file object, in tick order.
+    fp must stay open while the events are read."""
+    fp.seek(0)
+    _, _, ticks_per_beat = read_header(fp)
+    tracks = []
+    while True:
+        chunk_header = fp.read(8)
+        if len(chunk_header) < 8:
+            break
+        chunk_type, length = struct.unpack(">4sI", chunk_header)
+        if chunk_type == b"MTrk":
+            tracks.append(_track_events(fp, fp.tell(), length))
+        fp.seek(length, 1)
+    return ticks_per_beat, heapq.merge(*tracks, key=lambda event: event[0])
+
+
+def note_ons(events):
+    """(tick, note) of the note_on events with a velocity"""
+    for tick, status, data1, data2 in events:
+        if status & 0xF0 == NOTE_ON and data2:
+            yield tick, data1
+
+
+# Writing: tracks are encoded straight to bytes, the bytes of a beat are built
+# once for each distinct set of notes.
+
+TICKS_PER_BEAT = 480
+VELOCITY = 64
+_END_OF_TRACK = b"\x00\xff\x2f\x00"
+
+
+def encode_varlen(value):
+    data = bytearray([value & 0x7F])
+    value >>= 7
+    while value:
+        data.append(value & 0x7F | 0x80)
+        value >>= 7
+    data.reverse()
+    return bytes(data)
+
+
+def record_track(record, program=None, name=None, ticks_per_beat=TICKS_PER_BEAT):
+    """MTrk chunk of a record: the notes of a beat start together and end
+    ticks_per_beat later, as export_to_mid has always written them"""
+    body = bytearray()
+    if name:
+        encoded_name = name.encode("latin-1", "replace")
+        body += b"\x00\xff\x03" + encode_varlen(len(encoded_name)) + encoded_name
+    if program is not None:
+        body += bytes([0, 0xC0, program & 0x7F])
+
+    beat_end = encode_varlen(ticks_per_beat) + bytes([NOTE_OFF, 0, VELOCITY])
+    beat_bytes = {}
+    for notes in record.get_events():
+        data = beat_bytes.get(notes)
+        if data is None:
+            data = bytearray()
+            for note in notes:
+                data += bytes([0, NOTE_ON, note, VELOCITY])
+            data = beat_bytes[notes] = bytes(data + beat_end)
+        body += data
+    body += _END_OF_TRACK
+    return b"MTrk" + struct.pack(">I", len(body)) + body
+
+
+def write_header(fp, tracks_count, ticks_per_beat=TICKS_PER_BEAT):
+    midi_format = 0 if tracks_count == 1 else 1
+    fp.write(struct.pack(">4sIHHH", b"MThd", 6, midi_format, tracks_count, ticks_per_beat))
+
+
+def write_file(filename, tracks, ticks_per_beat=TICKS_PER_BEAT):
+    """Write MTrk chunks as a type 0 file when there is one, else type 1"""
+    with open(filename, "wb") as fp:
+        write_header(fp, len(tracks), ticks_per_beat)
+        fp.writelines(tracks)
@@ -3,56 +3,69 @@
 import sys
 import os
 import argparse
-import time
+import selectors
 import threading, queue
 
 import mido
-from mido import MidiFile
 import curses
 import curses.textpad
 from curses.textpad import rectangle
 
+import catalogue
 import const
+import midi
 from record import Record
 from input import Input
+from history import History, FLIP, TITLE
+from journal import Journal
+from player import play, note_messages
 
 
 def export_to_mid(record, program):
-    ticks = 480
-    mid = mido.MidiFile(type=0, ticks_per_beat=ticks)
-    track = mido.MidiTrack()
-    mid.tracks.append(track)
-
-    track.append(mido.Message("program_change", program=program, time=0))
-
-    for beat_index in range(record.beats_count):
-        for track_index in range(record.tracks_count):
-            if record.has_note(beat_index, track_index):
-                track.append(
-                    mido.Message("note_on", note=record.NOTES[track_index], time=0)
-                )
-        track.append(mido.Message("note_off", time=ticks))
-
-    mid.save(record.title + ".mid")
+    midi.write_file(record.title + ".mid", [midi.record_track(record, program)])
 
 
-def import_from_mid(record, filename):
+def import_from_mid(record, filename, grid=1.0):
+    """Import the notes of a .mid file, quantized in ticks: grid is the number
+    of beats of the record per quarter note. The record grows to the length
+    of the song, notes the music box does not have are skipped."""
     record.filename = os.path.splitext(filename)[0] + ".fpr"
     record.title = os.path.basename(filename)
     record.comment = "Imported from " + os.path.basename(filename)
 
-    beat_index = 0
-    track_index = 0
-
-    for msg in MidiFile(filename):
-        if not msg.is_meta:
-            if msg.type == "note_on":
-                track_index = record.NOTES.index(msg.note)
-                record.set_note(beat_index, track_index, True)
-            if msg.time > 0:
-                beat_index += 1
-        if beat_index >= const.BEAT_COUNT:
-            break
+    track_of_note = midi.note_table(record.NOTES)
+    with open(filename, "rb") as fp:
+        ticks_per_beat, events = midi.read_events(fp)
+        beats_per_tick = grid / ticks_per_beat
+        for tick, note in midi.note_ons(events):
+            track_index = track_of_note[note]
+            if track_index < 0:
+                continue
+            beat_index = int(tick * beats_per_tick + 0.5)
+            if beat_index >= record.beats_count:
+                record.resize_beats(beat_index + 1)
+            record.set_note(beat_index, track_index, True)
+
+
+def choose_tune(text):
+    """Path of a tune of the catalogue matching the text, asked on the terminal
+    when there are several ones"""
+    tunes = catalogue.search(catalogue.connect(), text)
+    if not tunes:
+        sys.exit("No tune of the catalogue matches " + repr(text))
+    if len(tunes) == 1:
+        return tunes[0][0]
+    for number, (path, title, beats_count, _) in enumerate(tunes, 1):
+        print("{:5d} {:32} {:5d} beats  {}".format(number, title, beats_count, path))
+    while True:
+        # not input(), the name is taken by the Input of the tracker below
+        print("tune number: ", end="", flush=True)
+        choice = sys.stdin.readline()
+        if not choice:
+            sys.exit()
+        choice = choice.strip()
+        if choice.isdigit() and 1 <= int(choice) <= len(tunes):
+            return tunes[int(choice) - 1][0]
 
 
 def draw_after_scroll(input):
@@ -60,7 +73,7 @@ def draw_after_scroll(input):
     input.draw_player_start_at()
     input.draw_beat_index()
 
-def main(stdscr, port, input, program):
+def main(stdscr, port, input, program, journal, recovered=0):
     cursor_y = input.start_y + input.offset_y
     cursor_x = input.start_x + input.offset_x
 
@@ -72,8 +85,17 @@ def main(stdscr, port, input, program):
     curses.init_pair(const.PAIR_HIGHLIGHT, curses.COLOR_RED, -1)
 
     record = input.record
+    history = History(record)
+    history.journal = journal
     input.window = stdscr
     input.draw(cursor_x, cursor_y)
+    journal_error = journal.error
+    if journal_error:
+        input.draw_status(journal_error)
+    elif recovered:
+        input.draw_status("{} unsaved edits recovered".format(recovered))
+    elif journal.stale:
+        input.draw_status("journal of another version kept as " + journal.stale)
 
     # edit box
     editwin = curses.newwin(1, 79, 20, 1)
@@ -81,19 +103,43 @@ def main(stdscr, port, input, program):
     box = curses.textpad.Textbox(editwin, insert_mode=True)
 
     thread_player = None  # thread to play music in background
-    stdscr.nodelay(True)  # poll for keys, so we can process player thread updates
+    stdscr.nodelay(True)  # read keys until none is left, then wait for the next event
     play_q = queue.Queue() # update messages (position) from player
 
+    # the player thread writes to this pipe after each update so that the loop
+    # below can sleep until either a key is pressed or an update is queued
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_w, False)
+
+    def wakeup():
+        try:
+            os.write(wakeup_w, b"\0")
+        except BlockingIOError:
+            pass  # the pipe is full of pending wakeups already
+
+    selector = selectors.DefaultSelector()
+    selector.register(sys.stdin, selectors.EVENT_READ)
+    selector.register(wakeup_r, selectors.EVENT_READ)
+
     while True:
         ch = stdscr.getch(cursor_y, cursor_x)
 
         if ch == curses.ERR:
-            # no keys pressed, process player thread updates then sleep for a few msec
+            if journal.error != journal_error:
+                journal_error = journal.error
+                input.draw_status(journal_error)
+            if journal.needs_compaction():
+                journal.compact()
+            # no keys left, wait for a key or a player thread update
+            for key, events in selector.select():
+                if key.fileobj == wakeup_r:
+                    os.read(wakeup_r, 4096)
             while not play_q.empty():
                 play_beat = play_q.get()
                 input.draw_player_start_at(play_beat)
-                stdscr.refresh()  # force fast refresh before sleeping..
-            time.sleep(0.01)
+                if play_beat == -1 and input.jitter is not None:
+                    input.draw_status(input.jitter)
+            # the next getch refreshes the screen
 
         elif ch == curses.KEY_UP:
             next_y = cursor_y - 1
@@ -149,46 +195,62 @@ def main(stdscr, port, input, program):
             input.player_start_at_inc()
             input.draw_player_start_at()
         elif ch == ord("+"):
-            record.right_shift(cursor_x - 1)
+            history.right_shift(cursor_x - 1)
             input.draw_partition()
         elif ch == ord("-"):
-            record.left_shift(cursor_x - 1)
+            history.left_shift(cursor_x - 1)
             input.draw_partition()
         elif ch == ord("e"):
             box.edit()
             title = box.gather()
-            input.record.title = title
+            history.set_title(title)
             input.draw(cursor_x, cursor_y)
+        elif ch == ord("z") or ch == ord("y"):
+            delta = history.undo() if ch == ord("z") else history.redo()
+            if delta is not None:
+                kind, beat_index, track_index, _ = delta
+                if kind == FLIP:
+                    input.draw_note(beat_index, track_index)
+                elif kind == TITLE:
+                    input.draw_title()
+                else:
+                    input.draw_partition()
         elif ch == ord(" "):
             x = input.display_from + cursor_x - 1
             y = cursor_y - 1
             if input.tone_descending:
                 y = input.tracks_count - 1 - y
-            record.reverse_note(x, y)
-            input.draw_partition()
+            history.reverse_note(x, y)
+            input.draw_note(x, y)
         elif ch == ord("t"):
             track_index = cursor_y - (input.start_y + input.offset_y)
             if input.tone_descending:
                 track_index = input.tracks_count - 1 - track_index
             port.send(mido.Message("note_on", note=record.NOTES[track_index]))
         elif ch == ord("r"):
-            beats = record.get_beats(cursor_x - 1)
-            for track_index in range(len(beats)):
-                if beats[track_index]:
-                    port.send(mido.Message("note_on", note=record.NOTES[track_index]))
+            for message in note_messages(record.get_notes(cursor_x - 1))[0]:
+                port.send(message)
         elif ch == ord("p"):
             if thread_player is not None and thread_player.is_alive():
                 thread_player.do_run = False
                 thread_player.join()
             else:
                 thread_player = threading.Thread(
-                    target=play, args=(play_q, port, record, input)
+                    target=play, args=(play_q, port, record, input, wakeup)
                 )
                 thread_player.start()
+        elif ch == ord("[") or ch == ord("]"):
+            input.tempo *= 1.1 if ch == ord("]") else 1 / 1.1
+            input.draw_status("tempo x{:.2f}".format(input.tempo))
+        elif ch == ord("c"):
+            input.loop = not input.loop
+            input.draw_status("loop " + ("on" if input.loop else "off"))
         elif ch == ord("s"):
-            record.save()
+            journal.compact()
         elif ch == ord("l"):
             record.load()
+            history.clear()
+            journal.reset()
             input.draw(cursor_x, cursor_y)
         elif ch == ord("q"):
             break
@@ -197,28 +259,13 @@ def main(stdscr, port, input, program):
         thread_player.do_run = False
         thread_player.join()
 
+    journal.close()
+    selector.close()
+    os.close(wakeup_r)
+    os.close(wakeup_w)
     port.close()
 
 
-def play(play_q, port, record, input):
-    t = threading.currentThread()
-    FPR_SEC_BETWEEN_BEATS = (25.0 / record.beats_count) if input.wholedisc else 0.5
-
-    for beat_index in range(input.player_start_at, record.beats_count):
-        if getattr(t, "do_run", True) == False:
-            break
-        for track_index in range(input.tracks_count):
-            if record.has_note(beat_index, track_index):
-                port.send(mido.Message("note_on", note=record.NOTES[track_index]))
-        time.sleep(FPR_SEC_BETWEEN_BEATS)
-        for track_index in range(input.tracks_count):
-            if record.has_note(beat_index, track_index):
-                port.send(mido.Message("note_off", note=record.NOTES[track_index]))
-        # update progress indicator
-        play_q.put(beat_index)
-    play_q.put(-1)
-
-
 if __name__ == "__main__":
     portname = None
     program = 10
@@ -227,9 +274,18 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--port", help="name of the midi port to use")
     parser.add_argument("--fpr", help=".fpr file to open")
+    parser.add_argument(
+        "--search",
+        help="choose the .fpr file to open among the tunes of the catalogue "
+        "(see fpr_catalogue.py) whose title, comment or path contains this text",
+    )
     parser.add_argument(
         "--mid", help="import from .mid file created with music box tune tracker"
     )
+    parser.add_argument(
+        "--grid",
+        help="beats of the record per quarter note when importing a .mid file (default: 1)",
+    )
     parser.add_argument("--program", help="midi instrument code")
     parser.add_argument("--title", help="set the title of a new tune")
     parser.add_argument(
@@ -244,6 +300,8 @@ if __name__ == "__main__":
         portname = args.port
     if args.fpr:
         record.filename = args.fpr
+    elif args.search is not None:
+        record.filename = choose_tune(args.search)
     if args.title:
         record.title = args.title
     if args.program:
@@ -255,12 +313,15 @@ if __name__ == "__main__":
     if record.filename:
         record.load()
     elif args.mid is not None:
-        import_from_mid(record, args.mid)
+        import_from_mid(record, args.mid, float(args.grid) if args.grid else 1.0)
     else:
         record.filename = record.title + ".fpr"
 
+    # edits not saved before a crash are replayed from the journal
+    journal = Journal(record)
     if record.beats_count < const.BEAT_COUNT:
         record.resize_beats(const.BEAT_COUNT)
+    recovered = journal.recover()
 
     try:
         port = mido.open_output(portname)
@@ -276,6 +337,6 @@ if __name__ == "__main__":
         input.wholedisc = True
 
     try:
-        curses.wrapper(main, port, input, program)
+        curses.wrapper(main, port, input, program, journal, recovered)
     except curses.error:
         sys.exit("Error when drawing to terminal (is the terminal too small ? )")
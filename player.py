@@ -0,0 +1,129 @@
+import functools
+import math
+import threading
+import time
+
+import mido
+
+import const
+
+# Playback of a record on a midi port. Each beat is fired at an absolute
+# deadline on the monotonic clock, so the time taken to send the messages and
+# the sleep overshoot of one beat are not added to the next one.
+
+# the last part of a wait is spent polling the clock, sleep() is not that precise
+SPIN_SEC = 0.001
+
+
+def wait_until(deadline):
+    remaining = deadline - time.monotonic()
+    if remaining > SPIN_SEC:
+        time.sleep(remaining - SPIN_SEC)
+    while time.monotonic() < deadline:
+        pass
+
+
+def beat_period(record, input):
+    """Seconds between two beats at the current tempo of the input"""
+    if input.wholedisc:
+        # a record without beats is spread as a full disc would be
+        period = const.WHOLEDISC_SEC / (record.beats_count or const.BEAT_COUNT)
+    else:
+        period = const.BEAT_SEC
+    return period / input.tempo
+
+
+@functools.lru_cache(maxsize=None)
+def note_messages(notes):
+    """Prebuilt note_on and note_off messages of a tuple of notes"""
+    return (
+        [mido.Message("note_on", note=note) for note in notes],
+        [mido.Message("note_off", note=note) for note in notes],
+    )
+
+
+class Jitter:
+    """Lateness of the beats against their deadline"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.total_square = 0.0
+        self.max = 0.0
+        self.first_at = None
+        self.last_at = None
+
+    def add(self, deadline, fired_at):
+        late = fired_at - deadline
+        self.count += 1
+        self.total += late
+        self.total_square += late * late
+        self.max = max(self.max, late)
+        if self.first_at is None:
+            self.first_at = fired_at
+        self.last_at = fired_at
+
+    def summary(self, nominal_period):
+        if self.count < 2:
+            return "jitter: not enough beats played"
+        mean = self.total / self.count
+        deviation = math.sqrt(max(self.total_square / self.count - mean * mean, 0))
+        period = (self.last_at - self.first_at) / (self.count - 1)
+        return (
+            "period {:.2f} ms (nominal {:.2f} ms), "
+            "late mean {:.3f} ms sd {:.3f} ms max {:.3f} ms over {} beats".format(
+                period * 1000,
+                nominal_period * 1000,
+                mean * 1000,
+                deviation * 1000,
+                self.max * 1000,
+                self.count,
+            )
+        )
+
+
+def play(play_q, port, record, input, wakeup=lambda: None):
+    """Play from input.player_start_at until the end of the record, or forever
+    while input.loop is set, until the do_run attribute of the thread is False.
+    input.tempo is read at every beat, so the tempo can be changed live.
+    A summary of the timing is left in input.jitter at the end.
+    The notes come from the event cache of the record, so edits made while
+    playing are heard."""
+    t = threading.current_thread()
+    jitter = Jitter()
+    notes_off = []
+    beat_index = input.player_start_at
+    deadline = time.monotonic()
+    period = beat_period(record, input)
+
+    while getattr(t, "do_run", True) != False:
+        beats = record.get_events()
+        if beat_index >= len(beats):
+            if not input.loop or input.player_start_at >= len(beats):
+                break
+            beat_index = input.player_start_at
+        notes_on, next_notes_off = note_messages(beats[beat_index])
+
+        wait_until(deadline)
+        jitter.add(deadline, time.monotonic())
+        for message in notes_off:
+            port.send(message)
+        for message in notes_on:
+            port.send(message)
+        notes_off = next_notes_off
+
+        # update progress indicator
+        play_q.put(beat_index)
+        wakeup()
+
+        period = beat_period(record, input)
+        deadline += period
+        beat_index += 1
+
+    wait_until(deadline)
+    for message in notes_off:
+        port.send(message)
+
+    input.jitter = jitter.summary(period)
+    play_q.put(-1)
+    wakeup()
@@ -1,4 +1,35 @@
 import os
+import stat
+import sys
+import tempfile
+import threading
+from array import array
+
+
+class _FprBits(dict):
+    # str.translate table turning a note into "1" and any other character into "0"
+
+    def __missing__(self, key):
+        return "0"
+
+
+_FPR_TO_BITS = _FprBits({ord("+"): "1"})
+
+# the player thread rebuilds the event cache while the editor changes the
+# partition: the changes and the rebuild are done under this lock, so a cache
+# built from a partition changed meanwhile is never kept
+_EDIT_LOCK = threading.Lock()
+
+
+def file_mode(filename):
+    """Permissions for a file written over filename: the ones it has, or
+    those of a new file (mkstemp makes its files private)"""
+    try:
+        return stat.S_IMODE(os.stat(filename).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
 
 
 class Record:
@@ -9,97 +40,247 @@ class Record:
     filename = None
     title = "Default"
     comment = ""
-    _partition = None  # list of lists of boolean: [track][beat] True indicates a note
+    _partition = None  # list of int, one per beat: bit n set indicates a note on track n
+    _events = None  # cache of the notes of each beat, None when it must be rebuilt
     tracks_count = 0
     beats_count = 0
     NOTES = [67, 72, 74, 76, 79, 81, 83, 84, 86, 88, 89, 91, 93, 95, 96, 98]
 
     def __init__(self, beats_count, tracks_count):
-        self._partition = [
-            [False for x in range(beats_count)] for y in range(tracks_count)
-        ]
+        self._partition = [0] * beats_count
         self.beats_count = beats_count
         self.tracks_count = tracks_count
 
     def has_note(self, beat_index, track_index):
-        return self._partition[track_index][beat_index]
+        return (self._partition[beat_index] >> track_index) & 1 == 1
 
     def set_note(self, beat_index, track_index, value):
-        self._partition[track_index][beat_index] = value
+        with _EDIT_LOCK:
+            if value:
+                self._partition[beat_index] |= 1 << track_index
+            else:
+                self._partition[beat_index] &= ~(1 << track_index)
+            self.__update_events(beat_index)
 
     def get_track(self, track_index):
-        return self._partition[track_index]
+        return [(mask >> track_index) & 1 == 1 for mask in self._partition]
 
     def get_beats(self, beat_index):
-        return [track_index[beat_index] for track_index in self._partition]
+        mask = self._partition[beat_index]
+        return [(mask >> track_index) & 1 == 1 for track_index in range(self.tracks_count)]
+
+    def get_mask(self, beat_index):
+        """Notes of a beat as a bitmask, bit n set for a note on track n"""
+        return self._partition[beat_index]
+
+    def set_mask(self, beat_index, mask):
+        with _EDIT_LOCK:
+            self._partition[beat_index] = mask & self.full_mask()
+            self.__update_events(beat_index)
+
+    def get_masks(self):
+        return list(self._partition)
+
+    def __mask_notes(self, mask):
+        return tuple(
+            note for track_index, note in enumerate(self.NOTES) if mask >> track_index & 1
+        )
+
+    def __update_events(self, beat_index):
+        if self._events is not None and beat_index < len(self._events):
+            self._events[beat_index] = self.__mask_notes(self._partition[beat_index])
+
+    def get_events(self):
+        """Midi notes of each beat as a list of tuples, built on first use and
+        kept up to date by the edits, so players and exporters do not have to
+        scan the tracks of every beat"""
+        events = self._events
+        if events is None:
+            with _EDIT_LOCK:
+                mask_notes = {}
+                events = []
+                for mask in self._partition[: self.beats_count]:
+                    notes = mask_notes.get(mask)
+                    if notes is None:
+                        notes = mask_notes[mask] = self.__mask_notes(mask)
+                    events.append(notes)
+                self._events = events
+        return events
+
+    def get_notes(self, beat_index):
+        """Midi notes of a beat as a tuple"""
+        return self.get_events()[beat_index]
+
+    def get_track_mask(self, track_index):
+        """Notes of a track as a bitmask, bit n set for a note on beat n"""
+        mask = 0
+        bit = 1 << track_index
+        for beat_index, beat_mask in enumerate(self._partition):
+            if beat_mask & bit:
+                mask |= 1 << beat_index
+        return mask
+
+    def full_mask(self):
+        return (1 << self.tracks_count) - 1
+
+    def count_notes(self, beat_index=None):
+        if beat_index is not None:
+            return bin(self._partition[beat_index]).count("1")
+        return sum(bin(mask).count("1") for mask in self._partition)
 
     def reverse_note(self, beat_index, track_index):
-        self._partition[track_index][beat_index] = not self._partition[track_index][
-            beat_index
-        ]
+        with _EDIT_LOCK:
+            self._partition[beat_index] ^= 1 << track_index
+            self.__update_events(beat_index)
 
     def left_shift(self, beat_index):
-        for track_index in range(self.tracks_count):
-            self._partition[track_index].pop(beat_index)
-            self._partition[track_index].append(False)
-        self.beats_count -= 1
+        """Remove a beat, returns the mask of its notes"""
+        with _EDIT_LOCK:
+            mask = self._partition.pop(beat_index)
+            self._partition.append(0)
+            self.beats_count -= 1
+            self._events = None
+        return mask
+
+    def undo_left_shift(self, beat_index, mask):
+        with _EDIT_LOCK:
+            self._partition.pop()
+            self._partition.insert(beat_index, mask)
+            self.beats_count += 1
+            self._events = None
 
     def right_shift(self, beat_index):
-        for track_index in range(self.tracks_count):
-            self._partition[track_index].insert(beat_index, False)
-        self.beats_count += 1
+        with _EDIT_LOCK:
+            self._partition.insert(beat_index, 0)
+            self.beats_count += 1
+            self._events = None
 
-    def resize_beats(self, size):
-        self.beats_count = size
-        for track_index in range(self.tracks_count):
-            diff_beat = self.beats_count - len(self._partition[track_index])
-            if diff_beat == 0:
-                continue
+    def undo_right_shift(self, beat_index):
+        with _EDIT_LOCK:
+            self._partition.pop(beat_index)
+            self.beats_count -= 1
+            self._events = None
 
+    def resize_beats(self, size):
+        with _EDIT_LOCK:
+            diff_beat = size - len(self._partition)
             if diff_beat > 0:
-                self._partition[track_index].extend([False] * diff_beat)
+                self._partition.extend([0] * diff_beat)
             elif diff_beat < 0:
-                self._partition[track_index] = self._partition[track_index][:diff_beat]
+                del self._partition[diff_beat:]
+            self.beats_count = size
+            self._events = None
+
+    def __combine(self, other, operation):
+        beats_count = max(self.beats_count, other.beats_count)
+        record = Record(beats_count, max(self.tracks_count, other.tracks_count))
+        record.title = self.title
+        record.comment = self.comment
+        for beat_index in range(beats_count):
+            mask = self._partition[beat_index] if beat_index < self.beats_count else 0
+            other_mask = (
+                other._partition[beat_index] if beat_index < other.beats_count else 0
+            )
+            record._partition[beat_index] = operation(mask, other_mask)
+        return record
+
+    def __or__(self, other):
+        return self.__combine(other, lambda a, b: a | b)
+
+    def __and__(self, other):
+        return self.__combine(other, lambda a, b: a & b)
+
+    def __xor__(self, other):
+        return self.__combine(other, lambda a, b: a ^ b)
+
+    @staticmethod
+    def from_buffer(buffer, beats_count, tracks_count, title="", comment=""):
+        """Record of a partition packed by to_buffer, e.g. a slice of a mmap"""
+        partition = array("H")
+        partition.frombytes(buffer[: beats_count * partition.itemsize])
+        if sys.byteorder == "big":
+            partition.byteswap()
+        record = Record(0, tracks_count)
+        record._partition = partition.tolist()
+        record.beats_count = beats_count
+        record.title = title
+        record.comment = comment
+        return record
+
+    def to_buffer(self):
+        """Partition as 16 bits little endian masks, one per beat"""
+        if self.tracks_count > 16:
+            raise ValueError("more than 16 tracks cannot be packed")
+        partition = array("H", self._partition[: self.beats_count])
+        if sys.byteorder == "big":
+            partition.byteswap()
+        return partition.tobytes()
 
     def load(self):
         try:
-            input = ""
             with open(self.filename) as fp:
-                lineno = 0
-                max_len_line = 0
-                while lineno < self.tracks_count:
-                    line = fp.readline().rstrip()
-                    len_line = len(line)
-                    if len_line > max_len_line:
-                        max_len_line = len_line
-                    self._partition[lineno] = [False] * len_line
-                    for i in range(len_line):
-                        self._partition[lineno][i] = line[i] == self.__NOTE_FPR
-                    lineno += 1
-
-                self.resize_beats(max_len_line)
-
-                self.title = fp.readline().rstrip()
-                while line:
-                    line = fp.readline()
-                    self.comment += line
-            fp.close()
+                self.read(fp)
         except FileNotFoundError as e:
             self.title = os.path.splitext(self.filename)[0]
             pass
 
+    def read(self, fp):
+        """Read a .fpr record from any text file-like object (e.g. sys.stdin)"""
+        rows = []
+        for lineno in range(self.tracks_count):
+            rows.append(fp.readline().rstrip())
+        max_len_line = max([len(row) for row in rows], default=0)
+        rows = [row.ljust(max_len_line, self.__EMPTY_FPR) for row in rows]
+
+        # each column read top to bottom gives the beat mask, lowest track first
+        partition = [
+            int("".join(column).translate(_FPR_TO_BITS)[::-1], 2)
+            for column in zip(*rows)
+        ]
+        with _EDIT_LOCK:
+            self._partition = partition
+            self.beats_count = max_len_line
+            self._events = None
+
+        self.title = fp.readline().rstrip()
+        self.comment = fp.read()
+
+    def __fpr_lines(self):
+        to_fpr = str.maketrans("01", self.__EMPTY_FPR + self.__NOTE_FPR)
+        beat_format = "0{}b".format(self.tracks_count)
+        columns = [
+            format(mask, beat_format)[::-1].translate(to_fpr)
+            for mask in self._partition[: self.beats_count]
+        ]
+        if columns:
+            for row in zip(*columns):
+                yield "".join(row) + "\n"
+        else:
+            yield "\n" * self.tracks_count
+        yield self.title + "\n"
+        yield self.comment
+
     def to_fpr(self):
-        output = ""
-        for track_index in range(0, self.tracks_count):
-            for beat_index in range(0, self.beats_count):
-                has_note = self.has_note(beat_index, track_index)
-                output += self.__NOTE_FPR if has_note else self.__EMPTY_FPR
-            output += "\n"
-        output += self.title + "\n"
-        output += self.comment
-        return output
+        return "".join(self.__fpr_lines())
+
+    def write(self, fp):
+        """Write the .fpr record to any text file-like object (e.g. sys.stdout)"""
+        fp.writelines(self.__fpr_lines())
 
     def save(self):
-        file = open(self.filename, "w")
-        file.write(self.to_fpr())
-        file.close()
+        # write to a temporary file then rename it over the record, so that an
+        # interrupted save never leaves a truncated .fpr behind
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        fd, tmp_filename = tempfile.mkstemp(
+            prefix=".", suffix=".fpr.tmp", dir=directory
+        )
+        try:
+            with os.fdopen(fd, "w") as file:
+                self.write(file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.chmod(tmp_filename, file_mode(self.filename))
+            os.replace(tmp_filename, self.filename)
+        except BaseException:
+            os.unlink(tmp_filename)
+            raise
@@ -1,4 +1,10 @@
+import functools
+import io
+import json
 import math
+import re
+import glyphs
+from collections import namedtuple
 import const
 from record import Record
 
@@ -41,130 +47,219 @@ TRACK_RADIUS = [
 
 
 class ExpandedRecord(Record):
+    # tracks 7 to 12 have their notes alternated on two physical tracks
+    SPLIT_TRACKS = range(7, 13)
+
     def __init__(self, beats_count, tracks_count, record):
         super().__init__(beats_count, tracks_count)
         self.title = record.title
 
-        for track_index in range(record.tracks_count):
-            track = record.get_track(track_index)
-            if track_index < 7:
-                self._partition[track_index] = track.copy()
-            elif track_index == 7:
-                self.__split_track(7, 8, track)
-            elif track_index == 8:
-                self.__split_track(9, 10, track)
-            elif track_index == 9:
-                self.__split_track(11, 12, track)
-            elif track_index == 10:
-                self.__split_track(13, 14, track)
-            elif track_index == 11:
-                self.__split_track(15, 16, track)
-            elif track_index == 12:
-                self.__split_track(17, 18, track)
-            elif track_index > 12:
-                self._partition[track_index + 6] = track.copy()
-
-    def __split_track(self, first_track_number, second_track_number, beats):
-        on_second_track = False
-        for beat_index in range(len(beats)):
-            if beats[beat_index] == True:
-                track_number = (
-                    second_track_number if on_second_track else first_track_number
-                )
-                self.set_note(beat_index, track_number, True)
-                on_second_track = not on_second_track
+        low_mask = (1 << 7) - 1
+        high_mask = record.full_mask() & ~((1 << 13) - 1)
+        on_second_track = [False] * record.tracks_count
+        for beat_index in range(min(beats_count, record.beats_count)):
+            mask = record.get_mask(beat_index)
+            expanded = (mask & low_mask) | ((mask & high_mask) << 6)
+            for track_index in self.SPLIT_TRACKS:
+                if mask >> track_index & 1:
+                    expanded |= self.__split_track_bit(track_index, on_second_track)
+            self._partition[beat_index] = expanded
 
+    def __split_track_bit(self, track_index, on_second_track):
+        first_track_number = 2 * track_index - 7
+        track_number = first_track_number + (1 if on_second_track[track_index] else 0)
+        on_second_track[track_index] = not on_second_track[track_index]
+        return 1 << track_number
 
-class Pin:
-    __inner = None
-    __outer = None
-    __angle = None
-    __is_second_side = None
-    __beat_count = 86
 
-    def __init__(self, inner, outer, is_second_side, beat_count):
-        self.__inner = inner
-        self.__outer = outer
-        self.__is_second_side = is_second_side
-        self.__beat_count = beat_count
+# a pin of the disc: radii in mm, angle in degrees
+Pin = namedtuple("Pin", ["inner", "outer", "angle", "is_second_side"])
 
-    def set_angle(self, track, note):
-        HEAD_OFFSET = 2
-        note_angle = 2 * math.pi / self.__beat_count
+TEMPLATE_FILE = "res/fisher-price-template.scad"
+PLACEHOLDER = re.compile(r"\{([A-Z0-9_]+)\}")
 
-        radius = TRACK_RADIUS[track]
-        angle = note_angle * note
-        angle -= HEAD_OFFSET / radius
-        angle = angle * 180 / math.pi
+HEAD_OFFSET = 2
+OVERLAP = 0.2
+PIN_WIDTH = 1
 
-        if self.__is_second_side:
-            angle = 360 - angle
 
-        self.__angle = angle
+def format_angle(angle, precision=None):
+    return "{}".format(angle) if precision is None else "{:.{}f}".format(angle, precision)
 
-    def to_str(self):
-        is_second_side_str = "1" if self.__is_second_side else "0"
-        return "pin({},{},{},{});".format(
-            self.__inner, self.__outer, self.__angle, is_second_side_str
+
+def pin_lines(pins, indent, precision=None):
+    line = indent + "pin({},{},{},{});\n"
+    for inner, outer, angle, is_second_side in pins:
+        yield line.format(
+            inner, outer, format_angle(angle, precision), "1" if is_second_side else "0"
         )
 
 
+def pin_data_lines(pins, indent, precision=None):
+    """The pins as a single call to the pins module of the template"""
+    yield indent + "pins([\n"
+    line = indent + "\t[{},{},{},{}],\n"
+    for inner, outer, angle, is_second_side in pins:
+        yield line.format(
+            inner, outer, format_angle(angle, precision), "1" if is_second_side else "0"
+        )
+    yield indent + "]);\n"
+
+
 def pins_to_str(pins, indent):
-    pin_str = ""
-    for pin in pins:
-        pin_str += indent + pin.to_str() + "\n"
-    return pin_str
+    return "".join(pin_lines(pins, indent))
+
+
+def get_track_beats(expanded_record):
+    """List for each track of the beat indexes having a note"""
+    track_beats = [[] for track_index in range(expanded_record.tracks_count)]
+    for beat_index in range(expanded_record.beats_count):
+        mask = expanded_record.get_mask(beat_index)
+        while mask:
+            bit = mask & -mask
+            track_beats[bit.bit_length() - 1].append(beat_index)
+            mask ^= bit
+    return track_beats
+
+
+def track_geometry(track_index):
+    """Inner and outer radius of the pins of a track and their head offset in radians"""
+    radius = TRACK_RADIUS[track_index]
+    inner = radius - 0.5 - (OVERLAP if track_index % 2 == 0 else 0)
+    outer = inner + 1 + OVERLAP
+    return inner, outer, HEAD_OFFSET / radius
+
+
+def pin_angles(beats, note_angle, head_angle, is_second_side):
+    angles = [(note_angle * note - head_angle) * 180 / math.pi for note in beats]
+    if is_second_side:
+        angles = [360 - angle for angle in angles]
+    return angles
+
+
+def iter_pins(expanded_record, is_second_side):
+    """Generate the pins track by track"""
+    beats_count = expanded_record.beats_count
+    note_angle = 2 * math.pi / beats_count if beats_count else 0
+
+    for track_index, beats in enumerate(get_track_beats(expanded_record)):
+        if not beats:
+            continue
+        inner, outer, head_angle = track_geometry(track_index)
+        angles = pin_angles(beats, note_angle, head_angle, is_second_side)
+        yield from [Pin(inner, outer, angle, is_second_side) for angle in angles]
 
 
 def get_pins(expanded_record, is_second_side):
-    pins = []
-    OVERLAP = 0.2
+    return list(iter_pins(expanded_record, is_second_side))
 
-    for track_index in range(expanded_record.tracks_count):
-        inner = (
-            TRACK_RADIUS[track_index] - 0.5 - (OVERLAP if track_index % 2 == 0 else 0)
-        )
-        outer = inner + 1 + OVERLAP
-        for note_index in range(expanded_record.beats_count):
-            if expanded_record.has_note(note_index, track_index):
-                pin = Pin(inner, outer, is_second_side, expanded_record.beats_count)
-                pin.set_angle(track_index, note_index)
-                pins.append(pin)
-    return pins
-
-
-def to_scad(version, date_time, thickness, record, record_bis=None):
-    with open("res/fisher-price-template.scad", "r") as content_file:
-        content = content_file.read()
-        content = content.replace("{VERSION}", version)
-        content = content.replace("{DATE_TIME}", date_time)
-        content = content.replace("{THICKNESS}", str(thickness))
-        content = content.replace("{SECOND_SIDE}", "0" if record_bis is None else "1")
-        content = content.replace("{BEATS1}", str(record.beats_count))
-        content = content.replace("{BEATS2}", "0" if record_bis is None else str(record_bis.beats_count))
-
-        indent = "\t" * 2
-        expanded_record = ExpandedRecord(record.beats_count, 22, record)
-        pins = get_pins(expanded_record, False)
-        pin_str = pins_to_str(pins, indent)
+
+@functools.lru_cache(maxsize=None)
+def load_template(filename=TEMPLATE_FILE):
+    """Split a template once into a tuple alternating text and placeholder names"""
+    with open(filename, "r") as content_file:
+        return tuple(PLACEHOLDER.split(content_file.read()))
+
+
+def title_line(title, side, indent, title_font=None):
+    if title_font is None:
+        return "\n" + indent + 'title("{}",{});\n\n'.format(title, side)
+
+    title_glyphs, indexes = glyphs.title_glyphs(title, title_font)
+    return "\n" + indent + "titleGlyphs({},{},{});\n\n".format(
+        json.dumps(title_glyphs, separators=(",", ":")),
+        json.dumps(indexes, separators=(",", ":")),
+        side,
+    )
+
+
+def notes_lines(
+    record,
+    record_bis,
+    indent,
+    compact=False,
+    precision=None,
+    title_font=None,
+):
+    lines = pin_data_lines if compact else pin_lines
+    for side, side_record in enumerate((record, record_bis)):
+        if side_record is None:
+            continue
+        expanded_record = ExpandedRecord(side_record.beats_count, 22, side_record)
+        yield from lines(iter_pins(expanded_record, side == 1), indent, precision)
 
         if expanded_record.title is not None:
-            pin_str += (
-                "\n" + indent + 'title("{}",{});\n\n'.format(expanded_record.title, "0")
-            )
+            yield title_line(expanded_record.title, side, indent, title_font)
 
-        if record_bis is not None:
-            expanded_record_bis = ExpandedRecord(record_bis.beats_count, 22, record_bis)
-            pins_bis = get_pins(expanded_record_bis, True)
-            pin_str += pins_to_str(pins_bis, indent)
 
-            if expanded_record_bis.title is not None:
-                pin_str += (
-                    "\n"
-                    + indent
-                    + 'title("{}",{});\n\n'.format(expanded_record_bis.title, "1")
+def write_scad(
+    fp,
+    version,
+    date_time,
+    thickness,
+    record,
+    record_bis=None,
+    compact=False,
+    precision=None,
+    title_font=None,
+):
+    """Write the scad of a disc to the file-like object fp
+
+    compact emits the pins of a side as one data list looped over by the
+    template instead of a pin() statement per note. precision, when set,
+    is the number of decimals of the angles. title_font, when set, is the DXF font of Write.scad whose
+    glyphs are written in the scad for the titles."""
+    values = {
+        "VERSION": version,
+        "DATE_TIME": date_time,
+        "THICKNESS": str(thickness),
+        "SECOND_SIDE": "0" if record_bis is None else "1",
+        "BEATS1": str(record.beats_count),
+        "BEATS2": "0" if record_bis is None else str(record_bis.beats_count),
+    }
+    indent = "\t" * 2
+
+    segments = load_template()
+    for index, segment in enumerate(segments):
+        if index % 2 == 0:
+            fp.write(segment)
+        elif segment == "NOTES":
+            fp.writelines(
+                notes_lines(
+                    record,
+                    record_bis,
+                    indent,
+                    compact,
+                    precision,
+                    title_font,
                 )
+            )
+        elif segment in values:
+            fp.write(values[segment])
+        else:
+            fp.write("{" + segment + "}")
 
-        content = content.replace("{NOTES}", pin_str)
 
-        return content
+def to_scad(
+    version,
+    date_time,
+    thickness,
+    record,
+    record_bis=None,
+    compact=False,
+    precision=None,
+    title_font=None,
+):
+    output = io.StringIO()
+    write_scad(
+        output,
+        version,
+        date_time,
+        thickness,
+        record,
+        record_bis,
+        compact,
+        precision,
+        title_font,
+    )
+    return output.getvalue()
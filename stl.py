@@ -0,0 +1,339 @@
+import functools
+import math
+import struct
+
+import scad
+
+# Build the disc of res/fisher-price-template.scad directly as a triangle mesh.
+# The blank is a solid of revolution, split in radial intervals of constant
+# bottom and top height, with the centre hole and the drive holes cut through
+# the inset. Pins are closed boxes overlapping the blank, as the children of
+# the union() of the scad: the mesh is several closed shells, not one solid. Every circle uses the same FRAGMENTS angles, like $fn in the
+# template, so faces and walls share their vertices.
+
+# same values as res/fisher-price-template.scad
+FRAGMENTS = 100
+R_STOCK = 60.58
+O_DRIVE = 21.8
+R_DRIVE = 1.55
+H_INSET = 1
+R_INSET = 25.6
+H_GROOVE = 1.2
+R_CENTRE = 3.22
+GROOVE_WIDTH = 2
+GROOVES = [28.15, 30.89, 33.71, 36.425, 39.225, 42, 44.825, 47.555, 50.315, 53.11, 55.9]
+
+# the drive holes are cut in sectors of the inset reaching from this radius
+# to R_INSET and DRIVE_SECTOR fragments on each side of a hole, their radial
+# edges have RADIAL_POINTS points between both radii
+R_DRIVE_SECTOR = 19
+DRIVE_SECTOR = 3
+RADIAL_POINTS = 8
+
+UP = (0, 0, 1)
+DOWN = (0, 0, -1)
+
+
+def cross(a, b):
+    return (
+        a[1] * b[2] - a[2] * b[1],
+        a[2] * b[0] - a[0] * b[2],
+        a[0] * b[1] - a[1] * b[0],
+    )
+
+
+def normal(triangle):
+    a, b, c = triangle
+    n = cross(
+        (b[0] - a[0], b[1] - a[1], b[2] - a[2]), (c[0] - a[0], c[1] - a[1], c[2] - a[2])
+    )
+    length = math.sqrt(n[0] * n[0] + n[1] * n[1] + n[2] * n[2])
+    return (n[0] / length, n[1] / length, n[2] / length) if length else (0, 0, 0)
+
+
+def oriented(a, b, c, direction):
+    """The triangle abc wound so that its normal points towards direction"""
+    n = cross(
+        (b[0] - a[0], b[1] - a[1], b[2] - a[2]), (c[0] - a[0], c[1] - a[1], c[2] - a[2])
+    )
+    if n[0] * direction[0] + n[1] * direction[1] + n[2] * direction[2] < 0:
+        return (a, c, b)
+    return (a, b, c)
+
+
+def quad(triangles, a, b, c, d, direction):
+    triangles.append(oriented(a, b, c, direction))
+    triangles.append(oriented(a, c, d, direction))
+
+
+@functools.lru_cache(maxsize=None)
+def ring(radius, centre=(0, 0)):
+    """Points of a circle as OpenSCAD places them for $fn = FRAGMENTS"""
+    return tuple(
+        (
+            centre[0] + radius * math.cos(2 * math.pi * i / FRAGMENTS),
+            centre[1] + radius * math.sin(2 * math.pi * i / FRAGMENTS),
+        )
+        for i in range(FRAGMENTS)
+    )
+
+
+def drive_holes():
+    """Centre and fragment index of the angle of each drive hole"""
+    return [
+        ((0, O_DRIVE), FRAGMENTS // 4),
+        ((0, -O_DRIVE), 3 * FRAGMENTS // 4),
+        ((O_DRIVE, 0), 0),
+        ((-O_DRIVE, 0), FRAGMENTS // 2),
+    ]
+
+
+def profile(thickness, has_second_side):
+    """Radial intervals of the blank as (inner radius, outer radius, bottom, top)"""
+    inset_bottom = H_INSET
+    inset_top = thickness - H_INSET + scad.OVERLAP
+    if inset_top <= inset_bottom:
+        raise ValueError("thickness {} is too small for the insets".format(thickness))
+    groove_top = thickness - H_GROOVE
+    groove_bottom = H_GROOVE if has_second_side else 0
+
+    intervals = [
+        (R_CENTRE, R_DRIVE_SECTOR, inset_bottom, inset_top),
+        (R_DRIVE_SECTOR, R_INSET, inset_bottom, inset_top),
+    ]
+    radius = R_INSET
+    for groove in GROOVES:
+        intervals.append((radius, groove, 0, thickness))
+        intervals.append((groove, groove + GROOVE_WIDTH, groove_bottom, groove_top))
+        radius = groove + GROOVE_WIDTH
+    intervals.append((radius, R_STOCK, 0, thickness))
+    return intervals
+
+
+def annulus_faces(triangles, inner, outer, z, direction):
+    inner_ring = ring(inner)
+    outer_ring = ring(outer)
+    for i in range(FRAGMENTS):
+        j = (i + 1) % FRAGMENTS
+        quad(
+            triangles,
+            inner_ring[i] + (z,),
+            outer_ring[i] + (z,),
+            outer_ring[j] + (z,),
+            inner_ring[j] + (z,),
+            direction,
+        )
+
+
+def wall(triangles, points, bottom, top, direction_of):
+    """Vertical faces along a closed loop of points, direction_of(point) gives
+    the side the faces look at"""
+    for i in range(len(points)):
+        a = points[i]
+        b = points[(i + 1) % len(points)]
+        middle = ((a[0] + b[0]) / 2, (a[1] + b[1]) / 2)
+        direction = direction_of(middle) + (0,)
+        quad(triangles, a + (bottom,), b + (bottom,), b + (top,), a + (top,), direction)
+
+
+def outward(point):
+    return point
+
+
+def inward(point):
+    return (-point[0], -point[1])
+
+
+@functools.lru_cache(maxsize=None)
+def radial_points(index):
+    """Points of the radial edge of a drive sector at a fragment index, from
+    R_DRIVE_SECTOR to R_INSET, subdivided so that every outline point of
+    the sector sees the part of the hole it is stitched to"""
+    inner = ring(R_DRIVE_SECTOR)[index]
+    outer = ring(R_INSET)[index]
+    points = [inner]
+    for k in range(1, RADIAL_POINTS + 1):
+        t = k / (RADIAL_POINTS + 1)
+        points.append(
+            (inner[0] + (outer[0] - inner[0]) * t, inner[1] + (outer[1] - inner[1]) * t)
+        )
+    points.append(outer)
+    return tuple(points)
+
+
+def fan(triangles, polygon, z, direction):
+    """Faces of a convex polygon, fanned from its first point"""
+    apex = polygon[0] + (z,)
+    for a, b in zip(polygon[1:], polygon[2:]):
+        triangles.append(oriented(apex, a + (z,), b + (z,), direction))
+
+
+def sector_faces(triangles, centre, index, bottom, top):
+    """Faces of the inset around a drive hole, stitched by angle around the hole"""
+    first = (index - DRIVE_SECTOR) % FRAGMENTS
+    last = (index + DRIVE_SECTOR) % FRAGMENTS
+    indexes = [(index + i) % FRAGMENTS for i in range(-DRIVE_SECTOR, DRIVE_SECTOR + 1)]
+    outline = [ring(R_INSET)[i] for i in indexes]
+    outline += list(reversed(radial_points(last)[1:-1]))
+    outline += [ring(R_DRIVE_SECTOR)[i] for i in reversed(indexes)]
+    outline += list(radial_points(first)[1:-1])
+    hole = list(ring(R_DRIVE, centre))
+
+    def angle(point):
+        return math.atan2(point[1] - centre[1], point[0] - centre[0])
+
+    # both loops sorted by angle from the first outline point
+    start = angle(outline[0])
+    outline = sorted(outline, key=lambda point: (angle(point) - start) % (2 * math.pi))
+    hole = sorted(hole, key=lambda point: (angle(point) - start) % (2 * math.pi))
+
+    def unwrapped_angle(points, k):
+        point = points[k % len(points)]
+        relative = (angle(point) - start) % (2 * math.pi)
+        return relative + 2 * math.pi * (k // len(points))
+
+    for z, direction in ((bottom, DOWN), (top, UP)):
+        o = h = 0
+        for step in range(len(outline) + len(hole)):
+            a = outline[o % len(outline)] + (z,)
+            b = hole[h % len(hole)] + (z,)
+            if h == len(hole) or (
+                o < len(outline)
+                and unwrapped_angle(outline, o + 1) <= unwrapped_angle(hole, h + 1)
+            ):
+                o += 1
+                c = outline[o % len(outline)] + (z,)
+            else:
+                h += 1
+                c = hole[h % len(hole)] + (z,)
+            triangles.append(oriented(a, b, c, direction))
+
+    wall(
+        triangles,
+        list(ring(R_DRIVE, centre)),
+        bottom,
+        top,
+        lambda point: (centre[0] - point[0], centre[1] - point[1]),
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def blank_mesh(thickness, has_second_side):
+    """Triangles of the blank, as a tuple shared by every disc of this shape"""
+    triangles = []
+    intervals = profile(thickness, has_second_side)
+
+    drive_sector = intervals[1]
+    for inner, outer, bottom, top in intervals:
+        if inner != R_DRIVE_SECTOR:
+            annulus_faces(triangles, inner, outer, bottom, DOWN)
+            annulus_faces(triangles, inner, outer, top, UP)
+
+    # the ring of the drive holes: quads out of the sectors, the ones next to
+    # a sector share the points of its radial edge
+    sectors = {}
+    for centre, index in drive_holes():
+        for i in range(-DRIVE_SECTOR, DRIVE_SECTOR):
+            sectors[(index + i) % FRAGMENTS] = None
+        sectors[(index - DRIVE_SECTOR - 1) % FRAGMENTS] = "before"
+        sectors[(index + DRIVE_SECTOR) % FRAGMENTS] = "after"
+    inner_ring = ring(R_DRIVE_SECTOR)
+    outer_ring = ring(R_INSET)
+    for i in range(FRAGMENTS):
+        j = (i + 1) % FRAGMENTS
+        if i not in sectors:
+            polygon = [inner_ring[i], outer_ring[i], outer_ring[j], inner_ring[j]]
+        elif sectors[i] == "before":
+            polygon = [inner_ring[i], outer_ring[i]] + list(reversed(radial_points(j)))
+        elif sectors[i] == "after":
+            polygon = [inner_ring[j]] + list(radial_points(i)) + [outer_ring[j]]
+        else:
+            continue
+        fan(triangles, polygon, drive_sector[2], DOWN)
+        fan(triangles, polygon, drive_sector[3], UP)
+
+    for centre, index in drive_holes():
+        sector_faces(triangles, centre, index, drive_sector[2], drive_sector[3])
+
+    # walls between intervals of different heights
+    first = intervals[0]
+    wall(triangles, list(ring(first[0])), first[2], first[3], inward)
+    for (_, radius, bottom, top), (_, _, next_bottom, next_top) in zip(
+        intervals, intervals[1:]
+    ):
+        # the faces look at the side missing material between both heights
+        points = list(ring(radius))
+        if top != next_top:
+            direction_of = outward if top > next_top else inward
+            wall(triangles, points, min(top, next_top), max(top, next_top), direction_of)
+        if bottom != next_bottom:
+            direction_of = outward if bottom < next_bottom else inward
+            wall(
+                triangles,
+                points,
+                min(bottom, next_bottom),
+                max(bottom, next_bottom),
+                direction_of,
+            )
+    last = intervals[-1]
+    wall(triangles, list(ring(last[1])), last[2], last[3], outward)
+    return tuple(triangles)
+
+
+def pin_mesh(triangles, pin, thickness):
+    """Closed box of a pin, placed as the pin module of the template"""
+    if pin.is_second_side:
+        bottom = -scad.OVERLAP
+    else:
+        bottom = thickness - H_GROOVE - scad.OVERLAP
+    top = bottom + H_GROOVE + scad.OVERLAP
+
+    angle = math.radians(pin.angle)
+    cos, sin = math.cos(angle), math.sin(angle)
+    half_width = scad.PIN_WIDTH / 2
+    corners = [
+        (x * cos - y * sin, x * sin + y * cos)
+        for x, y in (
+            (pin.inner, -half_width),
+            (pin.outer, -half_width),
+            (pin.outer, half_width),
+            (pin.inner, half_width),
+        )
+    ]
+    a, b, c, d = corners
+    quad(triangles, a + (bottom,), b + (bottom,), c + (bottom,), d + (bottom,), DOWN)
+    quad(triangles, a + (top,), b + (top,), c + (top,), d + (top,), UP)
+    centre = ((a[0] + c[0]) / 2, (a[1] + c[1]) / 2)
+    wall(
+        triangles,
+        corners,
+        bottom,
+        top,
+        lambda point: (point[0] - centre[0], point[1] - centre[1]),
+    )
+
+
+def disc_mesh(thickness, record, record_bis=None):
+    triangles = list(blank_mesh(thickness, record_bis is not None))
+    for side, side_record in enumerate((record, record_bis)):
+        if side_record is None:
+            continue
+        expanded_record = scad.ExpandedRecord(side_record.beats_count, 22, side_record)
+        for pin in scad.iter_pins(expanded_record, side == 1):
+            pin_mesh(triangles, pin, thickness)
+    return triangles
+
+
+def write_stl(fp, triangles, header=b"music box tune tracker"):
+    """Write triangles to the binary file-like object fp as binary STL"""
+    facet = struct.Struct("<12fH")
+    fp.write(header[:80].ljust(80, b"\0"))
+    fp.write(struct.pack("<I", len(triangles)))
+    fp.write(
+        b"".join(
+            [
+                facet.pack(*normal(triangle), *triangle[0], *triangle[1], *triangle[2], 0)
+                for triangle in triangles
+            ]
+        )
+    )
@@ -0,0 +1,103 @@
+import math
+
+import const
+import scad
+
+# Checks that a disc can be played before it is printed. The notes of each
+# physical track (after the split of tracks 7 to 12 by scad.ExpandedRecord)
+# are a bitmask of beats, so the notes too close to each other on a track are
+# found for all the beats at once with shifts and ands of these masks.
+
+# free space in mm a comb tooth needs between two pins to fall back on
+MIN_GAP_MM = 1.0
+# a tooth plucked on a beat cannot sound again on the next one
+RECOVERY_BEATS = 2
+PHYSICAL_TRACKS = len(scad.TRACK_RADIUS)
+
+
+def track_masks(expanded_record):
+    """Notes of each physical track as a bitmask, bit n set for a note on beat n"""
+    masks = [0] * expanded_record.tracks_count
+    for beat_index in range(expanded_record.beats_count):
+        mask = expanded_record.get_mask(beat_index)
+        while mask:
+            bit = mask & -mask
+            masks[bit.bit_length() - 1] |= 1 << beat_index
+            mask ^= bit
+    return masks
+
+
+def close_notes(mask, beats_count, gap):
+    """Beats having a note followed by another one gap beats later on the
+    same track, the disc being round"""
+    around = mask | mask << beats_count
+    close = mask & (around >> gap)
+    return [beat_index for beat_index in range(beats_count) if close >> beat_index & 1]
+
+
+def side_issues(record, beat_cut=const.BEAT_COUNT):
+    """Problems of one side as a list of dicts, empty when it is playable.
+    beat_cut is the number of beats put on the disc, 0 for all of them."""
+    issues = []
+    beats_count = record.beats_count
+    if 0 < beat_cut < beats_count:
+        lost = sum(record.count_notes(beat_index) for beat_index in range(beat_cut, beats_count))
+        if lost:
+            issues.append(
+                {"type": "overlength", "beats_count": beats_count, "beat_cut": beat_cut, "notes_lost": lost}
+            )
+        beats_count = beat_cut
+    if not beats_count:
+        return issues
+
+    expanded_record = scad.ExpandedRecord(beats_count, PHYSICAL_TRACKS, record)
+    note_angle = 2 * math.pi / beats_count
+    for track_index, mask in enumerate(track_masks(expanded_record)):
+        if not mask:
+            continue
+        step = scad.TRACK_RADIUS[track_index] * note_angle
+        spacing_gaps = math.ceil((MIN_GAP_MM + scad.PIN_WIDTH) / step)
+        for gap in range(1, max(spacing_gaps, RECOVERY_BEATS)):
+            beats = close_notes(mask, beats_count, gap)
+            if not beats:
+                continue
+            if gap < RECOVERY_BEATS:
+                issues.append({"type": "recovery", "track": track_index, "gap": gap, "beats": beats})
+            if gap < spacing_gaps:
+                issues.append(
+                    {
+                        "type": "spacing",
+                        "track": track_index,
+                        "gap": gap,
+                        "gap_mm": round(gap * step - scad.PIN_WIDTH, 3),
+                        "beats": beats,
+                    }
+                )
+    return issues
+
+
+def disc_report(record, record_bis=None, beat_cut=const.BEAT_COUNT, beat_cut_bis=const.BEAT_COUNT):
+    """Report of a disc as a dict, ready to be dumped as json"""
+    sides = []
+    for side, side_record, cut in ((0, record, beat_cut), (1, record_bis, beat_cut_bis)):
+        if side_record is not None:
+            sides.append({"side": side, "issues": side_issues(side_record, cut)})
+    return {"ok": not any(side["issues"] for side in sides), "sides": sides}
+
+
+def summary(report):
+    """One line description of the issues of a report"""
+    parts = []
+    for side in report["sides"]:
+        for issue in side["issues"]:
+            if issue["type"] == "overlength":
+                parts.append(
+                    "side {}: {} notes after beat {}".format(side["side"], issue["notes_lost"], issue["beat_cut"])
+                )
+            else:
+                parts.append(
+                    "side {}: {} on track {} at beats {}".format(
+                        side["side"], issue["type"], issue["track"], ",".join(map(str, issue["beats"]))
+                    )
+                )
+    return "; ".join(parts) or "ok"